@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BlockAssembler基于消息路径的性能测试
+对比逐个构造子消息再append的旧写法与原型复制+原地赋值的写法，
+统计每个方块构造的消息对象数量、分配的Python内存块数量、耗时和Python内存峰值，并检查两者输出一致
+
+命令行用法：
+    python assembler/benchmark_assembler.py [方块数量]
+"""
+
+import sys
+import os
+
+# 添加项目根目录和proto_gen到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "proto_gen"))
+
+import gc
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import assembler.block_assembler as block_assembler_module
+from assembler.block_assembler import BlockAssembler
+from config.block_config import BlockConfig
+from model.block_model import BlockModel
+from proto_gen.gia_pb2 import GIACollection
+
+
+# 统计内存块分配时使用的方块数量
+ALLOCATION_SAMPLE_SIZE = 2000
+
+# block_assembler中使用的消息类
+MESSAGE_CLASS_NAMES = ["Asset", "AssetMeta", "Component", "Position", "Scale", "TransformComponent",
+                       "Property", "NameProperty", "Entity", "EntityData", "TemplateReference", "Rotation"]
+
+
+class MessageCounter:
+    """
+    统计消息类的构造次数，替换block_assembler模块中的消息类名称
+    """
+
+    def __init__(self, message_class, counts: Dict[str, int]):
+        self._message_class = message_class
+        self._counts = counts
+
+    def __call__(self, *args, **kwargs):
+        self._counts[self._message_class.__name__] = self._counts.get(self._message_class.__name__, 0) + 1
+        return self._message_class(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._message_class, name)
+
+
+def create_blocks(count: int) -> List[BlockModel]:
+    templates = BlockConfig.AVAILABLE_BLOCKS
+    return [BlockModel(template_id=templates[i % len(templates)].template_id,
+                       name=f"Pixel_{i % 240}_{i // 240}",
+                       position_x=(i % 240) * 0.1,
+                       position_y=(i // 240) * 0.1,
+                       position_z=0.0,
+                       scale_x=0.1, scale_y=0.1, scale_z=0.1)
+            for i in range(count)]
+
+
+def build_legacy(blocks: List[BlockModel]) -> GIACollection:
+    """旧写法：每个方块构造全部子消息，再复制到集合中"""
+    assembler = BlockAssembler(entity_id_start=1078000000)
+    collection = GIACollection()
+    for block in blocks:
+        collection.Assets.append(assembler._create_asset(block))
+    return collection
+
+
+def build_prototype(blocks: List[BlockModel]) -> GIACollection:
+    """新写法：从缓存的原型复制，在集合中原地赋值 (与BlockAssembler.assemble的消息路径相同)"""
+    assembler = BlockAssembler(entity_id_start=1078000000)
+    collection = GIACollection()
+    for block in blocks:
+        assembler._fill_asset(collection.Assets.add(), block, assembler._generate_entity_id(block))
+    return collection
+
+
+def assemble_legacy(blocks: List[BlockModel]) -> bytes:
+    return build_legacy(blocks).SerializeToString()
+
+
+def assemble_prototype(blocks: List[BlockModel]) -> bytes:
+    return BlockAssembler(entity_id_start=1078000000).assemble(blocks)
+
+
+def count_allocations(build: Callable[[List[BlockModel]], GIACollection], blocks: List[BlockModel]) -> int:
+    """
+    统计构建集合时分配的Python内存块数量，包括.add()、CopyFrom、访问子消息属性产生的包装对象
+
+    逐行跟踪执行，累加每一步sys.getallocatedblocks()的增量 (只计增加，不抵消释放)，
+    同一行内创建后立即释放的临时对象不会被计入，结果为下限
+    """
+    state = {'created': 0, 'last': 0}
+
+    def tracer(frame, event, arg):
+        now = sys.getallocatedblocks()
+        if now > state['last']:
+            state['created'] += now - state['last']
+        state['last'] = now
+        return tracer
+
+    gc.collect()
+    state['last'] = sys.getallocatedblocks()
+    sys.settrace(tracer)
+    try:
+        collection = build(blocks)
+    finally:
+        sys.settrace(None)
+    del collection
+    return state['created']
+
+
+def run(name: str, func: Callable[[List[BlockModel]], bytes],
+        build: Callable[[List[BlockModel]], GIACollection], blocks: List[BlockModel]) -> bytes:
+    # 统计消息构造次数
+    counts: Dict[str, int] = {}
+    originals = {class_name: getattr(block_assembler_module, class_name) for class_name in MESSAGE_CLASS_NAMES}
+    try:
+        for class_name, message_class in originals.items():
+            setattr(block_assembler_module, class_name, MessageCounter(message_class, counts))
+        data = func(blocks)
+    finally:
+        for class_name, message_class in originals.items():
+            setattr(block_assembler_module, class_name, message_class)
+
+    # 逐行跟踪很慢，只统计前ALLOCATION_SAMPLE_SIZE个方块
+    sample = blocks[:ALLOCATION_SAMPLE_SIZE]
+    allocations = count_allocations(build, sample)
+
+    # 计时
+    start = time.perf_counter()
+    func(blocks)
+    elapsed = time.perf_counter() - start
+
+    # Python内存峰值 (protobuf消息本身分配在upb的arena中，不计入)
+    tracemalloc.start()
+    func(blocks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(counts.values())
+    print(f"{name}:")
+    print(f"  消息类构造函数调用: {total} 次，每个方块 {total / len(blocks):.2f} 次")
+    for class_name, count in sorted(counts.items(), key=lambda x: -x[1]):
+        print(f"    {class_name}: {count}")
+    print(f"  新分配的Python内存块 (对象、包装对象等): 每个方块 {allocations / len(sample):.2f} 个 "
+          f"(统计前 {len(sample)} 个方块)")
+    print(f"  耗时: {elapsed:.3f} 秒，每个方块 {elapsed / len(blocks) * 1e6:.2f} 微秒")
+    print(f"  Python内存峰值: {peak} 字节")
+    print()
+    return data
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    blocks = create_blocks(count)
+    print(f"方块数量: {count}")
+    print()
+
+    legacy = run("逐个构造子消息", assemble_legacy, build_legacy, blocks)
+    prototype = run("原型复制+原地赋值", assemble_prototype, build_prototype, blocks)
+
+    if legacy != prototype:
+        print("Error: 两种写法的输出不一致")
+        sys.exit(1)
+    print(f"输出一致: {len(prototype)} 字节")
+
+
+if __name__ == "__main__":
+    main()
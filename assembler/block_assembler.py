@@ -5,22 +5,58 @@
 将方块数据转换为protobuf格式的实体数据
 """
 
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from assembler.block_wire_encoder import BlockWireEncoder
+from model.block_batch import BlockBatch
+from helper.file_helper import FileHelper
+from helper.wire_helper import WireHelper
 from model.block_model import BlockModel
+from model.incremental_report import IncrementalReport
 from proto_gen.asset_pb2 import Asset, AssetMeta
 from proto_gen.entity_pb2 import Component, Position, Scale, TransformComponent, Property, NameProperty, Entity, EntityData, \
     TemplateReference, Rotation
 from proto_gen.gia_pb2 import GIACollection
 
 
+def _assemble_shard(shard: BlockBatch, entity_ids: np.ndarray, use_wire_encoder: bool) -> bytes:
+    """
+    在子进程中序列化一个分片，实体ID已由主进程分配
+    """
+    assembler = BlockAssembler(entity_id_start=0, use_wire_encoder=use_wire_encoder)
+    if use_wire_encoder:
+        assets = assembler.wire_encoder.iter_batch(shard, entity_ids)
+    else:
+        assets = (assembler._fill_asset(Asset(), block, entity_id).SerializeToString()
+                  for block, entity_id in zip(shard, entity_ids.tolist()))
+    return b''.join(BlockWireEncoder.encode_record(asset) for asset in assets)
+
+
 class BlockAssembler:
     """
     方块组装器
     """
 
-    def __init__(self, entity_id_start):
+    # 多进程组装时每个分片的方块数量
+    PARALLEL_SHARD_SIZE = 65536
+
+    def __init__(self, entity_id_start, use_wire_encoder: bool = False):
+        """
+        Args:
+            entity_id_start: 自动分配实体ID的起始值
+            use_wire_encoder: 是否使用BlockWireEncoder直接编码线格式，输出与消息路径逐字节一致
+        """
         self.entity_id_start = entity_id_start
         self.current_entity_id = entity_id_start
+        self.use_wire_encoder = use_wire_encoder
+        self.wire_encoder = BlockWireEncoder()
+
+        # (template_id, 是否有名称) -> 预先构建的Asset原型，只包含各方块相同的字段
+        self._prototypes: Dict[Tuple[int, bool], Asset] = {}
 
     @staticmethod
     def _create_component_transform(block: BlockModel) -> Component:
@@ -123,11 +159,23 @@ class BlockAssembler:
             return eid
         return block.entity_id
 
-    def _create_asset(self, block: BlockModel) -> Asset:
+    def _assign_entity_ids(self, batch: BlockBatch) -> np.ndarray:
+        """
+        为BlockBatch分配实体ID，与逐个调用_generate_entity_id的结果一致
+        """
+        entity_ids = np.array(batch.entity_id, dtype=np.int64)
+        auto = entity_ids == BlockBatch.AUTO_ENTITY_ID
+        auto_count = int(np.count_nonzero(auto))
+        entity_ids[auto] = np.arange(self.current_entity_id, self.current_entity_id + auto_count, dtype=np.int64)
+        self.current_entity_id += auto_count
+        return entity_ids
+
+    def _create_asset(self, block: BlockModel, entity_id: Optional[int] = None) -> Asset:
         """
         组装Asset
         """
-        entity_id = self._generate_entity_id(block)
+        if entity_id is None:
+            entity_id = self._generate_entity_id(block)
         entity_name = block.name if block.name else f"Entity_{entity_id}"
 
         data = self._create_entity_core(
@@ -153,14 +201,402 @@ class BlockAssembler:
 
         return asset
 
-    def assemble(self, blocks: List[BlockModel]) -> bytes:
+    def _get_prototype(self, template_id: int, named: bool) -> Asset:
+        """
+        获取Asset原型，包含常量子消息 (AssetMeta、TemplateReference、Entity外层字段、
+        TransformComponent.field_501、NameProperty.static_block)，坐标等子消息已置为存在
+        """
+        key = (template_id, named)
+        prototype = self._prototypes.get(key)
+        if prototype is None:
+            prototype = Asset(
+                meta=self._create_asset_meta(0),
+                type=Asset.AssetType.ENTITY,
+                entity_data=Entity(
+                    data=EntityData(
+                        template=TemplateReference(template_id=template_id, field_2=1),
+                        template_id_ref=template_id
+                    ),
+                    field_2=0,
+                    template_id=template_id
+                )
+            )
+            data = prototype.entity_data.data
+            if named:
+                data.properties.append(self._create_property_name(""))
+            data.components.append(self._create_component_transform(BlockModel(template_id=template_id)))
+            self._prototypes[key] = prototype
+        return prototype
+
+    def _fill_asset(self, asset: Asset, block: BlockModel, entity_id: int) -> Asset:
+        """
+        从原型复制后原地设置各方块不同的字段，结果与_create_asset一致
+
+        Args:
+            asset: 待填充的空Asset，如 collection.Assets.add()
+            block: 方块数据
+            entity_id: 已分配的实体ID
+
+        Returns:
+            Asset: 填充后的asset
+        """
+        asset.CopyFrom(self._get_prototype(block.template_id, bool(block.name)))
+
+        asset.meta.asset_id = entity_id
+        asset.name = block.name if block.name else f"Entity_{entity_id}"
+
+        data = asset.entity_data.data
+        data.entity_id = entity_id
+        if block.name:
+            data.properties[0].name.name = block.name
+
+        transform = data.components[0].transform
+        position = transform.position
+        position.x = block.position_x
+        position.y = block.position_y
+        position.z = block.position_z
+        rotation = transform.rotation
+        rotation.x = block.rotation_x
+        rotation.y = block.rotation_y
+        rotation.z = block.rotation_z
+        scale = transform.scale
+        scale.x = block.scale_x
+        scale.y = block.scale_y
+        scale.z = block.scale_z
+        return asset
+
+    def iter_wire_assets(self, blocks: Union[List[BlockModel], BlockBatch]) -> Iterator[bytes]:
+        """
+        使用线格式编码器逐个编码Asset
+
+        Args:
+            blocks: 方块数据列表或BlockBatch
+
+        Returns:
+            Iterator[bytes]: 每个Asset的序列化结果 (不含GIACollection的字段头)
+        """
+        if isinstance(blocks, BlockBatch):
+            yield from self.wire_encoder.iter_batch(blocks, self._assign_entity_ids(blocks))
+        else:
+            for block in blocks:
+                yield self.wire_encoder.encode_block(block, self._generate_entity_id(block))
+
+    def iter_records(self, blocks: Iterable[Union[BlockModel, BlockBatch]]) -> Iterator[bytes]:
+        """
+        逐个生成GIACollection.Assets记录，拼接后与assemble的结果一致
+
+        Args:
+            blocks: BlockBatch，或由BlockModel和BlockBatch组成的可迭代对象 (如按块生成数据的生成器)
+
+        Returns:
+            Iterator[bytes]: 每个Asset带字段头的序列化结果
+        """
+        if isinstance(blocks, BlockBatch):
+            blocks = (blocks,)
+
+        for item in blocks:
+            if isinstance(item, BlockBatch):
+                if self.use_wire_encoder:
+                    assets = self.iter_wire_assets(item)
+                else:
+                    assets = (self._fill_asset(Asset(), block, self._generate_entity_id(block)).SerializeToString()
+                              for block in item)
+            elif self.use_wire_encoder:
+                assets = (self.wire_encoder.encode_block(item, self._generate_entity_id(item)),)
+            else:
+                assets = (self._fill_asset(Asset(), item, self._generate_entity_id(item)).SerializeToString(),)
+
+            for asset in assets:
+                yield BlockWireEncoder.encode_record(asset)
+
+    def iter_parallel_shards(self, blocks: Union[List[BlockModel], BlockBatch], parallel: int) -> Iterator[bytes]:
+        """
+        按顺序把方块切分为分片，在进程池中序列化，按原顺序生成每个分片的结果
+
+        repeated字段的序列化结果可以按字节拼接，且实体ID在切分前已按顺序分配，
+        因此拼接后与串行结果逐字节一致
+
+        Args:
+            blocks: 方块数据列表或BlockBatch
+            parallel: 进程数
+
+        Returns:
+            Iterator[bytes]: 每个分片的序列化结果
+        """
+        if isinstance(blocks, BlockBatch):
+            entity_ids = self._assign_entity_ids(blocks)
+        else:
+            entity_ids = np.array([self._generate_entity_id(block) for block in blocks], dtype=np.int64)
+            blocks = BlockBatch.from_blocks(blocks)
+
+        shard_size = self.PARALLEL_SHARD_SIZE
+        with ProcessPoolExecutor(max_workers=parallel) as executor:
+            # 限制同时提交的分片数量，结果按提交顺序取出
+            pending = deque()
+            for start in range(0, len(blocks), shard_size):
+                end = start + shard_size
+                shard = BlockBatch(
+                    template_id=blocks.template_id[start:end],
+                    position=blocks.position[start:end],
+                    scale=blocks.scale[start:end],
+                    rotation=blocks.rotation[start:end],
+                    name_format=blocks.name_format,
+                    name_args=None if blocks.name_args is None else blocks.name_args[start:end],
+                    names=None if blocks.names is None else blocks.names[start:end]
+                )
+                pending.append(executor.submit(_assemble_shard, shard, entity_ids[start:end],
+                                               self.use_wire_encoder))
+                if len(pending) >= parallel * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _use_parallel(self, blocks, parallel: int) -> bool:
+        return (parallel > 1
+                and isinstance(blocks, (list, BlockBatch))
+                and len(blocks) > self.PARALLEL_SHARD_SIZE)
+
+    def assemble_to_file(self, blocks: Iterable[Union[BlockModel, BlockBatch]], path: str,
+                         parallel: int = 1) -> bool:
+        """
+        边编码边写入GIA文件，不在内存中保存完整的protobuf数据
+
+        Args:
+            blocks: BlockBatch，或由BlockModel和BlockBatch组成的可迭代对象
+            path: 保存的文件路径
+            parallel: 进程数，大于1且blocks为列表或BlockBatch时多进程序列化
+
+        Returns:
+            bool: 保存是否成功
+        """
+        if self._use_parallel(blocks, parallel):
+            return FileHelper.save_stream(self.iter_parallel_shards(blocks, parallel), path)
+        return FileHelper.save_stream(self.iter_records(blocks), path)
+
+    @staticmethod
+    def _read_transform(buffer, start: int, end: int) -> Optional[List[int]]:
+        """
+        在线格式上读取EntityData中第一个变换组件的位置/旋转/缩放
+
+        Returns:
+            Optional[List[int]]: 9个float32的位模式，没有变换组件时为None
+        """
+        for number, wire_type, _, component_start, component_end in WireHelper.iter_fields(buffer, start, end):
+            if number != 6 or wire_type != WireHelper.LENGTH_DELIMITED:
+                continue
+            transform = WireHelper.find_field(buffer, component_start, component_end, 11)
+            if transform is None or transform[0] != WireHelper.LENGTH_DELIMITED:
+                continue
+
+            # proto3中为0的分量不编码
+            bits = [0] * 9
+            for vector, vector_type, _, vector_start, vector_end in \
+                    WireHelper.iter_fields(buffer, transform[2], transform[3]):
+                if not 1 <= vector <= 3 or vector_type != WireHelper.LENGTH_DELIMITED:
+                    continue
+                for axis, axis_type, _, value_start, value_end in \
+                        WireHelper.iter_fields(buffer, vector_start, vector_end):
+                    if 1 <= axis <= 3 and axis_type == WireHelper.FIXED32:
+                        bits[(vector - 1) * 3 + axis - 1] = int.from_bytes(buffer[value_start:value_end], 'little')
+            return bits
+        return None
+
+    @staticmethod
+    def _index_previous(previous) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, List[Tuple[int, int]]]:
+        """
+        在线格式上读取上一次输出的每个Asset，不解码完整的消息，previous可以是映射文件的memoryview
+
+        Returns:
+            (names, entity_ids, template_ids, transforms, spans):
+                名称、实体ID、模板ID、(N, 9) float32 位置/旋转/缩放，以及每条记录 (含字段头) 的字节范围
+        """
+        names = []
+        entity_ids = []
+        template_ids = []
+        transform_bits = []
+        spans = []
+        # 没有变换组件的Asset记为NaN，与任何方块都不相等
+        missing = [0x7fc00000] * 9
+        for record_start, value_start, value_end in WireHelper.iter_record_spans(previous, 1):
+            name = ''
+            entity_id = 0
+            template_id = 0
+            bits = None
+            for number, wire_type, _, start, end in WireHelper.iter_fields(previous, value_start, value_end):
+                if wire_type != WireHelper.LENGTH_DELIMITED:
+                    continue
+                if number == 1:
+                    entity_id = WireHelper.read_varint_path(previous, start, end, (4,)) or 0
+                elif number == 3:
+                    name = str(previous[start:end], 'utf-8')
+                elif number == 12:
+                    template_id = WireHelper.read_varint_path(previous, start, end, (4,)) or 0
+                    data = WireHelper.find_field(previous, start, end, 1)
+                    if data is not None and data[0] == WireHelper.LENGTH_DELIMITED:
+                        bits = BlockAssembler._read_transform(previous, data[2], data[3])
+
+            names.append(name)
+            entity_ids.append(WireHelper.to_int32(entity_id))
+            template_ids.append(WireHelper.to_int32(template_id))
+            transform_bits.append(missing if bits is None else bits)
+            spans.append((record_start, value_end))
+
+        transforms = np.array(transform_bits, dtype=np.uint32).reshape(-1, 9).view(np.float32)
+        return (names, np.array(entity_ids, dtype=np.int64), np.array(template_ids, dtype=np.int64),
+                transforms, spans)
+
+    def assemble_incremental(self, blocks: Union[List[BlockModel], BlockBatch], previous,
+                             allocate_ids: Optional[Callable[[int, np.ndarray], int]] = None
+                             ) -> Tuple[bytes, IncrementalReport]:
+        """
+        参考上一次的输出增量组装
+
+        按名称 (包含网格坐标，如 Pixel_{x}_{y}) 匹配上一次的实体并沿用其实体ID，
+        模板、位置、旋转、缩放都未改变的Asset直接复制上一次的字节，不重新编码。
+        新增方块的实体ID由allocate_ids分配，未指定时从上一次最大的实体ID之后开始分配
+
+        Args:
+            blocks: 方块数据列表或BlockBatch
+            previous: 上一次输出的protobuf数据，可以是FileHelper.load_mapped返回的memoryview
+            allocate_ids: allocate_ids(数量, 已使用的实体ID) 返回新增方块的起始实体ID，只在有新增方块时调用。
+                已使用的实体ID为上一次输出的全部实体ID和本次沿用或指定的实体ID，分配前需登记为已占用，
+                如EntityIdAllocator.allocate_for_run的reserved_ids，只分配新增方块需要的实体ID
+
+        Returns:
+            (proto_data, report): 序列化结果和变化报告
+
+        Raises:
+            ValueError: 新分配的实体ID与沿用或指定的实体ID重复
+        """
+        if not isinstance(blocks, BlockBatch):
+            blocks = BlockBatch.from_blocks(blocks)
+
+        old_names, old_ids, old_template_ids, old_transforms, old_spans = self._index_previous(previous)
+        old_index = {}
+        for i, name in enumerate(old_names):
+            old_index.setdefault(name, i)
+
+        # 按名称匹配，每个旧实体只能被沿用一次
+        names = list(blocks.iter_names())
+        matched = np.full(len(blocks), -1, dtype=np.intp)
+        for j, name in enumerate(names):
+            i = old_index.pop(name, None) if name else None
+            if i is not None:
+                matched[j] = i
+        is_matched = matched >= 0
+
+        # 沿用实体ID，其余自动分配的ID由allocate_ids分配或从上一次最大的ID之后开始
+        entity_ids = np.array(blocks.entity_id, dtype=np.int64)
+        auto = entity_ids == BlockBatch.AUTO_ENTITY_ID
+        reuse = auto & is_matched
+        entity_ids[reuse] = old_ids[matched[reuse]]
+        new_auto = auto & ~is_matched
+        auto_count = int(np.count_nonzero(new_auto))
+        kept_ids = entity_ids[~new_auto]
+        if allocate_ids is not None:
+            if auto_count > 0:
+                # 上一次的输出可能写在数据库之外，先把已使用的实体ID交给分配器登记
+                self.current_entity_id = allocate_ids(auto_count, np.union1d(old_ids, kept_ids))
+        elif len(old_ids) > 0:
+            self.current_entity_id = max(self.current_entity_id, int(old_ids.max()) + 1)
+
+        new_start, new_end = self.current_entity_id, self.current_entity_id + auto_count
+        overlap = kept_ids[(kept_ids >= new_start) & (kept_ids < new_end)]
+        if auto_count > 0 and len(overlap) > 0:
+            raise ValueError(f"新分配的实体ID {new_start} - {new_end - 1} 与沿用的实体ID重复: "
+                             f"{', '.join(str(entity_id) for entity_id in overlap[:10].tolist())}")
+        entity_ids[new_auto] = np.arange(new_start, new_end, dtype=np.int64)
+        self.current_entity_id = new_end
+
+        # 按float32的位模式比较，与序列化结果一致
+        with np.errstate(over='ignore'):
+            transforms = np.concatenate((blocks.position, blocks.rotation, blocks.scale), axis=1).astype(np.float32)
+        safe_matched = np.maximum(matched, 0)
+        unchanged = (is_matched
+                     & (old_ids[safe_matched] == entity_ids)
+                     & (old_template_ids[safe_matched] == blocks.template_id)
+                     & (old_transforms[safe_matched].view(np.uint32) == transforms.view(np.uint32)).all(axis=1))
+
+        # 只编码有变化的方块
+        changed_rows = np.flatnonzero(~unchanged)
+        changed_batch = blocks.take(changed_rows)
+        if self.use_wire_encoder:
+            encoded = self.wire_encoder.iter_batch(changed_batch, entity_ids[changed_rows])
+        else:
+            encoded = (self._fill_asset(Asset(), block, entity_id).SerializeToString()
+                       for block, entity_id in zip(changed_batch, entity_ids[changed_rows].tolist()))
+
+        output = []
+        for j, is_unchanged in enumerate(unchanged.tolist()):
+            if is_unchanged:
+                start, end = old_spans[matched[j]]
+                output.append(previous[start:end])
+            else:
+                output.append(BlockWireEncoder.encode_record(next(encoded)))
+
+        report = IncrementalReport(unchanged_count=int(np.count_nonzero(unchanged)))
+        for j in changed_rows.tolist():
+            entry = (names[j] or f"Entity_{entity_ids[j]}", int(entity_ids[j]))
+            (report.changed if is_matched[j] else report.added).append(entry)
+        used = np.zeros(len(old_names), dtype=bool)
+        used[matched[is_matched]] = True
+        report.removed = [(old_names[i], int(old_ids[i])) for i in np.flatnonzero(~used).tolist()]
+
+        return b''.join(output), report
+
+    def verify_wire_encoder(self, blocks: Union[List[BlockModel], BlockBatch]) -> bytes:
+        """
+        同时使用线格式编码器和消息路径编码每个Asset并逐个比较，用于验证线格式编码器
+
+        Args:
+            blocks: 方块数据列表或BlockBatch
+
+        Returns:
+            bytes: 序列化结果
+
+        Raises:
+            ValueError: 两种路径的结果不一致
+        """
+        if isinstance(blocks, BlockBatch):
+            entity_id_array = self._assign_entity_ids(blocks)
+            entity_ids = entity_id_array.tolist()
+            wire_assets = self.wire_encoder.iter_batch(blocks, entity_id_array)
+        else:
+            entity_ids = [self._generate_entity_id(block) for block in blocks]
+            wire_assets = (self.wire_encoder.encode_block(block, entity_id)
+                           for block, entity_id in zip(blocks, entity_ids))
+
+        output = bytearray()
+        for i, (block, entity_id, actual) in enumerate(zip(blocks, entity_ids, wire_assets)):
+            expected = self._create_asset(block, entity_id).SerializeToString()
+            if actual != expected:
+                raise ValueError(f"线格式编码结果与消息路径不一致: 第{i}个方块 {block}\n"
+                                 f"  消息路径: {expected.hex()}\n"
+                                 f"  线格式:   {actual.hex()}")
+            output += BlockWireEncoder.encode_record(actual)
+        return bytes(output)
+
+    def assemble(self, blocks: Union[List[BlockModel], BlockBatch], verify: bool = False,
+                 parallel: int = 1) -> bytes:
         """
         批量转换并序列化
+
+        Args:
+            blocks: 方块数据列表，或列式存储的BlockBatch (逐个转换，不会一次性展开为BlockModel列表)
+            verify: 使用线格式编码器时，是否逐个与消息路径的结果比较
+            parallel: 进程数，大于1时分片多进程序列化，结果与串行一致
         """
+        if not verify and self._use_parallel(blocks, parallel):
+            return b''.join(self.iter_parallel_shards(blocks, parallel))
+
+        if self.use_wire_encoder:
+            if verify:
+                return self.verify_wire_encoder(blocks)
+            return b''.join(BlockWireEncoder.encode_record(asset) for asset in self.iter_wire_assets(blocks))
+
         collection = GIACollection()
         for block in blocks:
-            asset = self._create_asset(block)
-            collection.Assets.append(asset)
+            self._fill_asset(collection.Assets.add(), block, self._generate_entity_id(block))
         return collection.SerializeToString()
 
     def reset_entity_id(self, start_id=None):
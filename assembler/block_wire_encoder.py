@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+方块实体的protobuf线格式编码器
+不创建protobuf消息对象，直接按固定结构拼接字节，输出与BlockAssembler基于消息的路径逐字节一致
+
+单个Asset的结构 (字段号按升序编码，proto3中值为0的标量字段省略)：
+Asset
+  1  meta: AssetMeta { 2: 1, 3: ENTITY(2), 4: asset_id }
+  3  name: string
+  5  type: ENTITY(3)
+  12 entity_data: Entity
+       1 data: EntityData
+           1 entity_id
+           2 template: TemplateReference { 1: template_id, 2: 1 }
+           5 properties: Property { 1: NAME(1), 11: NameProperty { 1: name, 2: STATIC(1) } }  (名称非空时)
+           6 components: Component { 1: TRANSFORM(1), 11: TransformComponent {
+                 1: Position, 2: Rotation, 3: Scale, 501: 4294967295 } }
+           8 template_id_ref
+       4 template_id
+"""
+
+import struct
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+from model.block_batch import BlockBatch
+from model.block_model import BlockModel
+
+
+class BlockWireEncoder:
+    """
+    方块实体线格式编码器
+    """
+
+    INT32_MIN = -(1 << 31)
+    INT32_MAX = (1 << 31) - 1
+
+    # 常量片段
+    META_PREFIX = b'\x10\x01\x18\x02'  # AssetMeta.field_2 = 1, meta_type = ENTITY
+    ASSET_TYPE = b'\x28\x03'  # Asset.type = ENTITY
+    COMPONENT_PREFIX = b'\x08\x01'  # Component.component_type = TRANSFORM
+    TRANSFORM_SUFFIX = b'\xa8\x1f\xff\xff\xff\xff\x0f'  # TransformComponent.field_501 = 4294967295
+    PROPERTY_PREFIX = b'\x08\x01'  # Property.property_type = NAME
+    NAME_STATIC = b'\x10\x01'  # NameProperty.static_block = STATIC
+
+    ZERO_FLOAT = b'\x00\x00\x00\x00'
+
+    def __init__(self):
+        # template_id -> (EntityData.template, EntityData.template_id_ref, Entity.template_id) 的编码结果
+        self._template_fragments: Dict[int, Tuple[bytes, bytes, bytes]] = {}
+
+    @staticmethod
+    def encode_varint(value: int) -> bytes:
+        """编码无符号varint，负数按64位补码编码"""
+        if 0 <= value < 0x80:
+            return bytes((value,))
+        value &= 0xFFFFFFFFFFFFFFFF
+        out = bytearray()
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+        return bytes(out)
+
+    @staticmethod
+    def _length_delimited(tag: bytes, payload: bytes) -> bytes:
+        length = len(payload)
+        if length < 0x80:
+            return tag + bytes((length,)) + payload
+        return tag + BlockWireEncoder.encode_varint(length) + payload
+
+    @staticmethod
+    def _check_int32(value: int, field: str) -> int:
+        if not BlockWireEncoder.INT32_MIN <= value <= BlockWireEncoder.INT32_MAX:
+            raise ValueError(f"{field} 超出int32范围: {value}")
+        return value
+
+    @staticmethod
+    def _varint_field(tag: bytes, value: int) -> bytes:
+        """proto3标量字段，值为0时省略"""
+        if value == 0:
+            return b''
+        return tag + BlockWireEncoder.encode_varint(value)
+
+    @staticmethod
+    def pack_floats(*values: float) -> bytes:
+        """
+        按protobuf的规则把double转换为float32小端字节，超出范围时为inf而不是报错
+        """
+        try:
+            return struct.pack(f'<{len(values)}f', *values)
+        except OverflowError:
+            with np.errstate(over='ignore'):
+                return np.array(values, dtype=np.float64).astype('<f4').tobytes()
+
+    @staticmethod
+    def _encode_vec3(tag: bytes, raw: bytes) -> bytes:
+        """
+        编码Position/Rotation/Scale子消息，raw为12字节float32
+
+        与proto3一致，位模式为全0的分量省略 (-0.0会保留)
+        """
+        zero = BlockWireEncoder.ZERO_FLOAT
+        x, y, z = raw[0:4], raw[4:8], raw[8:12]
+        if x != zero and y != zero and z != zero:
+            return tag + b'\x0f\x0d' + x + b'\x15' + y + b'\x1d' + z
+
+        body = b''
+        if x != zero:
+            body += b'\x0d' + x
+        if y != zero:
+            body += b'\x15' + y
+        if z != zero:
+            body += b'\x1d' + z
+        return tag + bytes((len(body),)) + body
+
+    def _get_template_fragments(self, template_id: int) -> Tuple[bytes, bytes, bytes]:
+        fragments = self._template_fragments.get(template_id)
+        if fragments is None:
+            self._check_int32(template_id, "template_id")
+            template_ref = self._length_delimited(
+                b'\x12', self._varint_field(b'\x08', template_id) + b'\x10\x01')
+            fragments = (template_ref,
+                         self._varint_field(b'\x40', template_id),
+                         self._varint_field(b'\x20', template_id))
+            self._template_fragments[template_id] = fragments
+        return fragments
+
+    def encode_asset_raw(self, entity_id: int, template_id: int, name: str,
+                         raw_position: bytes, raw_rotation: bytes, raw_scale: bytes) -> bytes:
+        """
+        编码单个Asset消息 (不含GIACollection的字段头)
+
+        Args:
+            entity_id: 实体ID
+            template_id: 模板ID
+            name: 方块名称，为空时属性列表为空，Asset名称为 Entity_{entity_id}
+            raw_position: 12字节float32小端坐标
+            raw_rotation: 12字节float32小端旋转
+            raw_scale: 12字节float32小端缩放
+
+        Returns:
+            bytes: Asset的序列化结果
+        """
+        self._check_int32(entity_id, "entity_id")
+        template_ref, template_id_ref, entity_template_id = self._get_template_fragments(template_id)
+        entity_id_field = self._varint_field(b'\x08', entity_id)
+
+        transform = (self._encode_vec3(b'\x0a', raw_position)
+                     + self._encode_vec3(b'\x12', raw_rotation)
+                     + self._encode_vec3(b'\x1a', raw_scale)
+                     + self.TRANSFORM_SUFFIX)
+        component = self._length_delimited(
+            b'\x32', self.COMPONENT_PREFIX + self._length_delimited(b'\x5a', transform))
+
+        if name:
+            name_bytes = name.encode('utf-8')
+            name_prop = self._length_delimited(b'\x0a', name_bytes) + self.NAME_STATIC
+            properties = self._length_delimited(
+                b'\x2a', self.PROPERTY_PREFIX + self._length_delimited(b'\x5a', name_prop))
+        else:
+            name_bytes = f"Entity_{entity_id}".encode('utf-8')
+            properties = b''
+
+        entity_data = entity_id_field + template_ref + properties + component + template_id_ref
+        entity = self._length_delimited(b'\x0a', entity_data) + entity_template_id
+
+        meta = self.META_PREFIX + self._varint_field(b'\x20', entity_id)
+
+        return (self._length_delimited(b'\x0a', meta)
+                + self._length_delimited(b'\x1a', name_bytes)
+                + self.ASSET_TYPE
+                + self._length_delimited(b'\x62', entity))
+
+    def encode_block(self, block: BlockModel, entity_id: int) -> bytes:
+        """
+        编码单个BlockModel为Asset消息
+
+        Args:
+            block: 方块数据
+            entity_id: 已分配的实体ID
+
+        Returns:
+            bytes: Asset的序列化结果
+        """
+        return self.encode_asset_raw(
+            entity_id, block.template_id, block.name,
+            self.pack_floats(block.position_x, block.position_y, block.position_z),
+            self.pack_floats(block.rotation_x, block.rotation_y, block.rotation_z),
+            self.pack_floats(block.scale_x, block.scale_y, block.scale_z)
+        )
+
+    def iter_batch(self, batch: BlockBatch, entity_ids: np.ndarray) -> Iterator[bytes]:
+        """
+        按顺序编码BlockBatch中的每个方块为Asset消息
+
+        Args:
+            batch: 方块批量数据
+            entity_ids: (N,) 已分配的实体ID
+
+        Returns:
+            Iterator[bytes]: 每个Asset的序列化结果
+        """
+        names = batch.iter_names()
+        chunk_size = BlockBatch.ITER_CHUNK_SIZE
+        for start in range(0, len(batch), chunk_size):
+            end = start + chunk_size
+            # 整块转换为float32字节，与protobuf的double -> float转换一致
+            with np.errstate(over='ignore'):
+                positions = batch.position[start:end].astype('<f4').tobytes()
+                rotations = batch.rotation[start:end].astype('<f4').tobytes()
+                scales = batch.scale[start:end].astype('<f4').tobytes()
+
+            rows = zip(entity_ids[start:end].tolist(), batch.template_id[start:end].tolist())
+            for i, (entity_id, template_id) in enumerate(rows):
+                offset = i * 12
+                yield self.encode_asset_raw(
+                    entity_id, template_id, next(names),
+                    positions[offset:offset + 12],
+                    rotations[offset:offset + 12],
+                    scales[offset:offset + 12]
+                )
+
+    @staticmethod
+    def encode_record(asset_bytes: bytes) -> bytes:
+        """
+        为Asset加上GIACollection.Assets (字段1) 的字段头
+        """
+        return BlockWireEncoder._length_delimited(b'\x0a', asset_bytes)
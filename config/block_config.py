@@ -4,7 +4,7 @@
 方块模板配置
 定义可用于体素化模型的所有基础方块的属性
 """
-from typing import List
+from typing import Tuple
 
 
 class BlockTemplate:
@@ -21,7 +21,8 @@ class BlockTemplate:
 
 
 class BlockConfig:
-    AVAILABLE_BLOCKS: List[BlockTemplate] = [
+    # 不可变的元组，TemplateRegistry按对象缓存其注册表；需要修改时整体替换为新的元组
+    AVAILABLE_BLOCKS: Tuple[BlockTemplate, ...] = (
         # 木质箱子
         BlockTemplate(
             template_id=20001224,
@@ -155,4 +156,4 @@ class BlockConfig:
             size_units=5.0,
             default_scale_tuple=(1.0, 10.1, 1.0)
         ),
-    ]
+    )
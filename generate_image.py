@@ -13,13 +13,21 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "proto_gen"))
 
 import tkinter as tk
 from tkinter import filedialog
-from PIL import Image
-from typing import List, Tuple
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageSequence
+from typing import List, Optional, Tuple, Union
+from model.block_batch import BlockBatch
 from model.block_model import BlockModel
 from assembler.block_assembler import BlockAssembler
+from helper.entity_id_allocator import EntityIdAllocator
 from helper.file_helper import FileHelper
 from config.block_config import BlockTemplate, BlockConfig
 from helper.block_helper import BlockHelper
+from helper.template_registry import TemplateRegistry
 
 
 def ask_input(prompt: str, default, type_func=str):
@@ -47,9 +55,17 @@ def interactive_config():
     print()
 
     print("--- 基础设置 ---")
-    output_width = ask_input("输出宽度 (像素)", 240, int)
-    output_height = ask_input("输出高度 (像素)", 240, int)
+    max_entity_count = ask_input("最大实体数量 (0=按输出宽高)", 0, int)
+    output_width = 240
+    output_height = 240
+    if max_entity_count <= 0:
+        output_width = ask_input("输出宽度 (像素)", 240, int)
+        output_height = ask_input("输出高度 (像素)", 240, int)
     keep_aspect = ask_input("保持宽高比 (是/否)", True, lambda x: x.lower() in ('y', 'yes', '是', '1', ''))
+    if max_entity_count > 0 and not keep_aspect:
+        # 按实体数量选择分辨率时，输出宽高只决定拉伸后的宽高比
+        output_width = ask_input("拉伸后的宽高比 - 宽", 240, int)
+        output_height = ask_input("拉伸后的宽高比 - 高", 240, int)
     global_scale = ask_input("全局缩放", 0.1, float)
     print()
 
@@ -74,6 +90,11 @@ def interactive_config():
 
     print("--- 高级设置 ---")
     alpha_threshold = ask_input("透明像素阈值 (0-255)", 128, int)
+    print("  合并方式: none=不合并, runs=按行合并相同模板的像素, rects=合并为矩形, quadtree=四叉树分解")
+    merge_mode = ask_input("合并方式", 'none')
+    quadtree_max_error = 0.0
+    if merge_mode == 'quadtree':
+        quadtree_max_error = ask_input("四叉树叶子最大颜色误差 (0-2)", 0.0, float)
     entity_id_start = ask_input("起始实体ID", 1078000000, int)
     print()
 
@@ -83,11 +104,14 @@ def interactive_config():
     return {
         'OUTPUT_WIDTH': output_width,
         'OUTPUT_HEIGHT': output_height,
+        'MAX_ENTITY_COUNT': max_entity_count,
         'KEEP_ASPECT_RATIO': keep_aspect,
         'GLOBAL_SCALE': global_scale,
         'START_POSITION': {'x': start_x, 'y': start_y, 'z': start_z},
         'AXIS_MAPPING': axis_mapping,
         'ALPHA_THRESHOLD': alpha_threshold,
+        'MERGE_MODE': merge_mode,
+        'QUADTREE_MAX_ERROR': quadtree_max_error,
         'ENTITY_ID_START': entity_id_start,
     }
 
@@ -118,9 +142,35 @@ class Config:
     KEEP_ASPECT_RATIO = True  # 保持图片宽高比
     RESIZE_METHOD = Image.LANCZOS  # 缩放算法
 
+    # 使用磁盘缓存的颜色查找表匹配模板 (首次使用时自动构建)
+    USE_COLOR_LUT = False
+
+    # 合并相同模板的相邻像素以减少实体数量: 'none' 不合并, 'runs' 按行合并, 'rects' 合并为矩形,
+    # 'quadtree' 四叉树分解为边长为2的幂的正方形
+    MERGE_MODE = 'none'
+
+    # 最大实体数量，大于0时忽略输出宽高，自动选择实体数量不超过该值的最大分辨率
+    MAX_ENTITY_COUNT = 0
+
+    # 四叉树叶子内像素与叶子模板的最大HSV距离 (0-2)，越大实体越少、颜色越不准确
+    QUADTREE_MAX_ERROR = 0.0
+
+    # 直接编码protobuf线格式，不创建消息对象 (输出与消息路径逐字节一致)
+    USE_WIRE_ENCODER = True
+
+    # 序列化使用的进程数，方块数量较少时自动使用单进程
+    ASSEMBLE_WORKERS = os.cpu_count() or 1
+
+    # 输出文件已存在时增量生成: 沿用同一网格位置的实体ID，未改变的实体直接复制上一次的字节
+    INCREMENTAL = False
+
     # 起始实体ID
     ENTITY_ID_START = 1078000000
 
+    # 实体ID分配数据库，非空时从ENTITY_ID_START开始分配未被占用的实体ID，避开ENTITY_ID_SCAN_PATHS中已有文件和其他生成器的实体ID
+    ENTITY_ID_DB = ""
+    ENTITY_ID_SCAN_PATHS = ["output"]
+
 
 class ImageSelector:
     """选择图片"""
@@ -171,6 +221,64 @@ class ImageProcessor:
         Returns:
             Image.Image: 调整后的图片
         """
+        img = ImageProcessor.load(image_path)
+        return ImageProcessor.resize(img, target_width, target_height, keep_aspect, resize_method)
+
+    @staticmethod
+    def get_frame_count(image_path: str) -> int:
+        """获取图片的帧数，静态图片为1"""
+        with Image.open(image_path) as img:
+            return getattr(img, 'n_frames', 1)
+
+    @staticmethod
+    def load_frames_and_resize(
+            image_path: str,
+            target_width: int,
+            target_height: int,
+            keep_aspect: bool = True,
+            resize_method=Image.LANCZOS
+    ) -> List[Image.Image]:
+        """
+        加载动画图片 (GIF/APNG/WebP) 的所有帧并调整大小
+
+        Args:
+            image_path: 图片路径
+            target_width: 目标宽度
+            target_height: 目标高度
+            keep_aspect: 是否保持宽高比
+            resize_method: 缩放算法
+
+        Returns:
+            List[Image.Image]: 调整后的每一帧
+        """
+        return [ImageProcessor.resize(frame, target_width, target_height, keep_aspect, resize_method)
+                for frame in ImageProcessor.load_frames(image_path)]
+
+    @staticmethod
+    def load_frames(image_path: str) -> List[Image.Image]:
+        """
+        加载动画图片 (GIF/APNG/WebP) 的所有帧，转换为RGBA模式，不调整大小
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            List[Image.Image]: 每一帧
+        """
+        with Image.open(image_path) as img:
+            return [frame.convert('RGBA') for frame in ImageSequence.Iterator(img)]
+
+    @staticmethod
+    def load(image_path: str) -> Image.Image:
+        """
+        加载图片并转换为RGBA模式
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            Image.Image: RGBA模式的图片
+        """
         # 加载图片
         img = Image.open(image_path)
 
@@ -178,6 +286,29 @@ class ImageProcessor:
         if img.mode != 'RGBA':
             img = img.convert('RGBA')
 
+        return img
+
+    @staticmethod
+    def resize(
+            img: Image.Image,
+            target_width: int,
+            target_height: int,
+            keep_aspect: bool = True,
+            resize_method=Image.LANCZOS
+    ) -> Image.Image:
+        """
+        调整图片大小
+
+        Args:
+            img: RGBA模式的PIL图片对象
+            target_width: 目标宽度
+            target_height: 目标高度
+            keep_aspect: 是否保持宽高比
+            resize_method: 缩放算法
+
+        Returns:
+            Image.Image: 调整后的图片
+        """
         # 计算缩放尺寸
         if keep_aspect:
             # 保持宽高比，按较小的缩放比例
@@ -222,10 +353,29 @@ class ImageProcessor:
 
         return pixels
 
+    @staticmethod
+    def get_pixel_array(img: Image.Image) -> np.ndarray:
+        """
+        获取图片的像素数组，不创建逐像素的Python对象
+
+        Args:
+            img: PIL图片对象 (RGBA)
+
+        Returns:
+            np.ndarray: (height, width, 4) uint8只读数组，与get_pixel_colors一样已翻转Y轴，
+                        [0][0]是左下角。翻转通过负步长视图完成，不复制数据
+        """
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        return np.asarray(img)[::-1]
+
 
 class ImageBlockConverter:
     """将图片像素转换为方块数据"""
 
+    # merge_rects中长度超过此值的段用numpy计算直方图
+    RECT_SCAN_NUMPY_WIDTH = 32
+
     @staticmethod
     def calculate_position(img_x: int, img_y: int,
                            global_scale: float) -> Tuple[float, float, float]:
@@ -253,13 +403,53 @@ class ImageBlockConverter:
         return position[h_axis], position[v_axis], position[d_axis]
 
     @staticmethod
-    def pixels_to_blocks(pixels: List[List[Tuple[int, int, int, int]]],
+    def get_axis_permutation() -> List[int]:
+        """
+        获取AXIS_MAPPING对应的坐标轴排列
+
+        Returns:
+            List[int]: 水平、垂直、深度方向依次对应的世界坐标轴下标 (x=0, y=1, z=2)
+        """
+        axis_index = {'x': 0, 'y': 1, 'z': 2}
+        return [axis_index[Config.AXIS_MAPPING[direction]] for direction in ('horizontal', 'vertical', 'depth')]
+
+    @staticmethod
+    def calculate_positions(img_xs: np.ndarray, img_ys: np.ndarray,
+                            global_scale: float) -> np.ndarray:
+        """
+        批量计算方块的3D世界坐标，结果与逐个调用calculate_position一致
+
+        Args:
+            img_xs: 图片X坐标数组（列）
+            img_ys: 图片Y坐标数组（行，已翻转）
+            global_scale: 全局缩放参数
+
+        Returns:
+            np.ndarray: (N, 3) 坐标数组
+        """
+        img_xs = np.asarray(img_xs)
+        img_ys = np.asarray(img_ys)
+
+        # 直接写入排列后的列，避免再复制一次整个坐标数组
+        position = np.empty((len(img_xs), 3), dtype=np.float64)
+        for column, axis in enumerate(ImageBlockConverter.get_axis_permutation()):
+            if axis == 0:
+                position[:, column] = Config.START_POSITION['x'] + img_xs * global_scale
+            elif axis == 1:
+                position[:, column] = Config.START_POSITION['y'] + img_ys * global_scale
+            else:
+                position[:, column] = Config.START_POSITION['z']
+
+        return position
+
+    @staticmethod
+    def pixels_to_blocks(pixels: Union[np.ndarray, List[List[Tuple[int, int, int, int]]]],
                          templates: List[BlockTemplate]) -> List[BlockModel]:
         """
         将像素颜色转换为方块数据列表
 
         Args:
-            pixels: 像素颜色数组
+            pixels: 像素颜色数组，get_pixel_array返回的 (height, width, 4) 数组或get_pixel_colors返回的二维列表
             templates: 可用模板列表
 
         Returns:
@@ -272,6 +462,16 @@ class ImageBlockConverter:
         total_pixels = width * height
         processed = 0
 
+        registry = TemplateRegistry.of(templates)
+
+        # 颜色去重后一次性批量查找所有像素最匹配的模板
+        template_indices, unique_count = BlockHelper.match_unique_colors(
+            np.asarray(pixels, dtype=np.uint8).reshape(height, width, 4)[..., :3],
+            templates,
+            use_lut=Config.USE_COLOR_LUT
+        )
+        print(f"  颜色去重: {total_pixels} 个像素共 {unique_count} 种颜色")
+
         for y in range(height):
             for x in range(width):
                 rgba = pixels[y][x]
@@ -280,8 +480,7 @@ class ImageBlockConverter:
                     processed += 1
                     continue
 
-                # 查找最匹配的模板
-                template = BlockHelper.find_closest_template_rgb((rgba[0], rgba[1], rgba[2]), templates)
+                template_index = template_indices[y, x]
 
                 # 计算位置
                 position_x, position_y, position_z = ImageBlockConverter.calculate_position(
@@ -290,14 +489,11 @@ class ImageBlockConverter:
                 )
 
                 # 获取该模板的缩放值
-                scale_x, scale_y, scale_z = BlockHelper.calculate_scale(
-                    template,
-                    Config.GLOBAL_SCALE
-                )
+                scale_x, scale_y, scale_z = registry.get_scale(template_index, Config.GLOBAL_SCALE)
 
                 # 创建方块数据
                 block = BlockModel(
-                    template_id=template.template_id,
+                    template_id=registry[template_index].template_id,
                     name=f"Pixel_{x}_{y}",
                     position_x=position_x,
                     position_y=position_y,
@@ -318,16 +514,663 @@ class ImageBlockConverter:
         print()  # 换行
         return blocks
 
+    @staticmethod
+    def pixels_to_batch(pixels: Union[np.ndarray, List[List[Tuple[int, int, int, int]]]],
+                        templates: List[BlockTemplate]) -> BlockBatch:
+        """
+        将像素颜色转换为列式存储的方块数据，不创建BlockModel和名称字符串，
+        方块顺序与数据和pixels_to_blocks一致
+
+        Args:
+            pixels: 像素颜色数组，get_pixel_array返回的 (height, width, 4) 数组或get_pixel_colors返回的二维列表
+            templates: 可用模板列表
+
+        Returns:
+            BlockBatch: 方块批量数据，名称格式为 Pixel_{x}_{y}
+        """
+        registry = TemplateRegistry.of(templates)
+        index_grid = ImageBlockConverter.match_pixels(pixels, templates)
+
+        # 按行优先顺序取出不透明像素
+        ys, xs = np.nonzero(index_grid >= 0)
+        selected = index_grid[ys, xs]
+
+        return BlockBatch(
+            template_id=registry.template_ids[selected],
+            position=ImageBlockConverter.calculate_positions(xs, ys, Config.GLOBAL_SCALE),
+            scale=registry.scales[selected] * Config.GLOBAL_SCALE,
+            name_format="Pixel_{0}_{1}",
+            name_args=np.stack((xs, ys), axis=-1)
+        )
+
+    @staticmethod
+    def match_pixels(pixels: Union[np.ndarray, List[List[Tuple[int, int, int, int]]]],
+                     templates: List[BlockTemplate], verbose: bool = True) -> np.ndarray:
+        """
+        为每个像素匹配模板
+
+        Args:
+            pixels: 像素颜色数组，get_pixel_array返回的 (height, width, 4) 数组或get_pixel_colors返回的二维列表
+            templates: 可用模板列表
+            verbose: 是否打印颜色去重信息
+
+        Returns:
+            np.ndarray: (height, width) 模板在templates中的下标，透明像素为-1
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.size == 0:
+            pixels = pixels.reshape(0, 0, 4)
+        height, width = pixels.shape[:2]
+
+        # 颜色去重后一次性批量查找所有像素最匹配的模板
+        template_indices, unique_count = BlockHelper.match_unique_colors(
+            pixels[..., :3], templates, use_lut=Config.USE_COLOR_LUT
+        )
+        if verbose:
+            print(f"  颜色去重: {width * height} 个像素共 {unique_count} 种颜色")
+
+        return np.where(pixels[..., 3] >= Config.ALPHA_THRESHOLD, template_indices, -1)
+
+    @staticmethod
+    def frames_to_batches(frames: np.ndarray, templates: List[BlockTemplate],
+                          entity_id_start: int) -> Tuple[List[BlockBatch], np.ndarray]:
+        """
+        将动画的每一帧转换为方块数据，第一帧包含所有不透明像素，之后每帧只包含模板改变的像素
+
+        像素 (x, y) 的实体ID固定为 entity_id_start + y * width + x，在所有帧中保持不变。
+        GIA无法删除实体，像素变为透明后再次出现时，与它最后一次不透明时的模板比较
+
+        Args:
+            frames: (帧数, height, width, 4) 像素数组，每帧为get_pixel_array的结果
+            templates: 可用模板列表
+            entity_id_start: 起始实体ID
+
+        Returns:
+            (batches, removed_counts): 每帧的方块数据，以及每帧由不透明变为透明的像素数量
+        """
+        frame_count, height, width = frames.shape[:3]
+        registry = TemplateRegistry.of(templates)
+
+        # 所有帧一起去重匹配
+        index_grid = ImageBlockConverter.match_pixels(
+            frames.reshape(frame_count * height, width, 4), templates
+        ).reshape(frame_count, height, width)
+
+        # 变为透明的像素无法删除，游戏中仍显示之前的方块，因此与该像素最近一次不透明时的模板比较
+        frame_numbers = np.arange(frame_count).reshape(-1, 1, 1)
+        last_opaque = np.maximum.accumulate(np.where(index_grid >= 0, frame_numbers, -1), axis=0)
+        shown = np.where(last_opaque >= 0,
+                         np.take_along_axis(index_grid, np.maximum(last_opaque, 0), axis=0), -1)
+
+        # 第一帧与全透明比较
+        empty = np.full((1, height, width), -1, dtype=index_grid.dtype)
+        previous_shown = np.concatenate((empty, shown[:-1]))
+        previous = np.concatenate((empty, index_grid[:-1]))
+
+        changed = (index_grid >= 0) & (index_grid != previous_shown)
+        removed_counts = np.count_nonzero((index_grid < 0) & (previous >= 0), axis=(1, 2))
+
+        fs, ys, xs = np.nonzero(changed)
+        selected = index_grid[fs, ys, xs]
+        template_ids = registry.template_ids[selected]
+        positions = ImageBlockConverter.calculate_positions(xs, ys, Config.GLOBAL_SCALE)
+        scales = registry.scales[selected] * Config.GLOBAL_SCALE
+        entity_ids = entity_id_start + ys.astype(np.int64) * width + xs
+        name_args = np.stack((xs, ys), axis=-1)
+
+        # 按帧切分
+        bounds = np.searchsorted(fs, np.arange(frame_count + 1))
+        batches = [BlockBatch(
+            template_id=template_ids[start:end],
+            position=positions[start:end],
+            scale=scales[start:end],
+            entity_id=entity_ids[start:end],
+            name_format="Pixel_{0}_{1}",
+            name_args=name_args[start:end]
+        ) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        return batches, removed_counts
+
+    @staticmethod
+    def merge_runs(index_grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        把每行中连续的同模板像素合并为一个矩形
+
+        Args:
+            index_grid: match_pixels返回的 (height, width) 模板下标，-1为透明
+
+        Returns:
+            (xs, ys, widths, heights, indices): 每个矩形左下角的像素坐标、宽、高 (均为1) 和模板下标，按行优先排列
+        """
+        ys, xs = np.nonzero(index_grid >= 0)
+        selected = index_grid[ys, xs]
+
+        # 换行、不相邻或模板不同的像素开始新的一段
+        starts = np.ones(len(xs), dtype=bool)
+        starts[1:] = (ys[1:] != ys[:-1]) | (xs[1:] != xs[:-1] + 1) | (selected[1:] != selected[:-1])
+        starts = np.flatnonzero(starts)
+        widths = np.diff(np.append(starts, len(xs)))
+
+        return xs[starts], ys[starts], widths, np.ones_like(widths), selected[starts]
+
+    @staticmethod
+    def merge_rects(index_grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        把相同模板的像素分解为若干互不重叠的矩形
+
+        按行优先顺序扫描，以每个未覆盖的像素为左下角，
+        在同一行可延伸的宽度内用各列向上的连续高度 (直方图) 求面积最大的矩形，
+        覆盖后继续扫描
+
+        各列向上的连续高度只在开始时计算一次：之前的行开始的矩形覆盖了某列上方的像素时
+        也一定覆盖了当前行的像素，因此当前行未覆盖像素的向上高度不会因覆盖而改变
+
+        Args:
+            index_grid: match_pixels返回的 (height, width) 模板下标，-1为透明
+
+        Returns:
+            (xs, ys, widths, heights, indices): 每个矩形左下角的像素坐标、宽、高和模板下标
+        """
+        remaining = np.array(index_grid, dtype=np.intp)
+        height = remaining.shape[0]
+
+        # up[y, x]: 从第y行开始向上连续的同模板像素数量
+        up = np.zeros(remaining.shape, dtype=np.intp)
+        if height > 0:
+            up[-1] = remaining[-1] >= 0
+        for y in range(height - 2, -1, -1):
+            same = (remaining[y] >= 0) & (remaining[y] == remaining[y + 1])
+            up[y] = np.where(same, up[y + 1] + 1, remaining[y] >= 0)
+
+        rects = []
+        for y in range(height):
+            # 之前的行开始的矩形可能覆盖了本行的部分像素，按覆盖后的行切分为同模板的段，
+            # 本行开始的矩形只覆盖各自所在段中的像素
+            row = remaining[y]
+            xs = np.flatnonzero(row >= 0)
+            if len(xs) == 0:
+                continue
+            selected = row[xs]
+            starts = np.ones(len(xs), dtype=bool)
+            starts[1:] = (xs[1:] != xs[:-1] + 1) | (selected[1:] != selected[:-1])
+            starts = np.flatnonzero(starts)
+            widths = np.diff(np.append(starts, len(xs)))
+
+            up_row = up[y].tolist()
+            for x, segment_end, template_index in zip(xs[starts].tolist(), (xs[starts] + widths).tolist(),
+                                                      selected[starts].tolist()):
+                while x < segment_end:
+                    # 宽度为w时的最大高度为前w列高度的最小值，较短的段直接逐列计算
+                    if segment_end - x <= ImageBlockConverter.RECT_SCAN_NUMPY_WIDTH:
+                        rect_width, rect_height, best_area, column_height = 1, up_row[x], 0, up_row[x]
+                        for width in range(1, segment_end - x + 1):
+                            column_height = min(column_height, up_row[x + width - 1])
+                            if column_height * width > best_area:
+                                best_area, rect_width, rect_height = column_height * width, width, column_height
+                    else:
+                        heights = np.minimum.accumulate(up[y, x:segment_end])
+                        areas = heights * np.arange(1, len(heights) + 1)
+                        rect_width = int(np.argmax(areas)) + 1
+                        rect_height = int(heights[rect_width - 1])
+
+                    # 本行已经切分完毕，只需覆盖上方的行
+                    if rect_height > 1:
+                        remaining[y + 1:y + rect_height, x:x + rect_width] = -1
+                    rects.append((x, y, rect_width, rect_height, template_index))
+                    x += rect_width
+
+        rects = np.array(rects, dtype=np.intp).reshape(-1, 5)
+        return rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3], rects[:, 4]
+
+    @staticmethod
+    def merge_quadtree(index_grid: np.ndarray, rgb: np.ndarray, templates: List[BlockTemplate],
+                       max_error: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        用四叉树把图片分解为边长为2的幂的正方形，每个叶子使用一个模板
+
+        图片补齐为边长为2的幂的正方形 (补齐部分透明)，自底向上逐层计算每个格子能否作为叶子：
+        格子必须全部不透明，且所有像素匹配到同一模板，或者格子平均颜色匹配到的模板
+        与格子内每个像素的HSV距离都不超过max_error。再自顶向下取最大的可用格子
+
+        Args:
+            index_grid: match_pixels返回的 (height, width) 模板下标，-1为透明
+            rgb: (height, width, 3) 像素RGB颜色
+            templates: 可用模板列表
+            max_error: 叶子内像素与叶子模板的最大HSV距离，为0时叶子内所有像素必须匹配到同一模板
+
+        Returns:
+            (xs, ys, widths, heights, indices): 每个叶子左下角的像素坐标、边长和模板下标，按行优先排列
+        """
+        height, width = index_grid.shape
+        size = 1
+        while size < max(height, width):
+            size *= 2
+
+        grid = np.full((size, size), -1, dtype=np.intp)
+        grid[:height, :width] = index_grid
+
+        registry = TemplateRegistry.of(templates)
+        if max_error > 0:
+            points = np.zeros((size, size, 3), dtype=np.float64)
+            points[:height, :width] = BlockHelper.rgb_array_to_polar(rgb)
+            color_sum = np.zeros((size, size, 3), dtype=np.float64)
+            color_sum[:height, :width] = rgb
+            opaque_count = (grid >= 0).astype(np.int64)
+
+        # 每层每个格子作为叶子时使用的模板下标，-1表示不能作为叶子
+        levels = [grid]
+        uniform = grid
+        cell = 1
+        while cell < size:
+            cell *= 2
+            count = size // cell
+
+            # 四个子格子都是同一模板时父格子也是
+            quad = uniform.reshape(count, 2, count, 2)
+            first = quad[:, 0, :, 0]
+            uniform = np.where((quad == first[:, None, :, None]).all(axis=(1, 3)) & (first >= 0), first, -1)
+            accepted = uniform.copy()
+
+            if max_error > 0:
+                opaque_count = opaque_count.reshape(count, 2, count, 2).sum(axis=(1, 3))
+                color_sum = color_sum.reshape(count, 2, count, 2, 3).sum(axis=(1, 3))
+
+                rows, cols = np.nonzero((uniform < 0) & (opaque_count == cell * cell))
+                if len(rows) > 0:
+                    mean = np.rint(color_sum[rows, cols] / (cell * cell)).astype(np.uint8)
+                    candidates = BlockHelper.match_colors(mean, templates, use_lut=Config.USE_COLOR_LUT)
+                    cell_points = points.reshape(count, cell, count, cell, 3)[rows, :, cols]
+                    diff = cell_points - registry.points[candidates][:, None, None, :]
+                    error = np.sqrt(np.einsum('kijc,kijc->kij', diff, diff)).max(axis=(1, 2))
+                    fit = error <= max_error
+                    accepted[rows[fit], cols[fit]] = candidates[fit]
+
+            levels.append(accepted)
+
+        # 自顶向下，取未被更大叶子覆盖的可用格子
+        xs, ys, sizes, indices = [], [], [], []
+        covered = np.zeros((1, 1), dtype=bool)
+        for level in range(len(levels) - 1, -1, -1):
+            accepted = levels[level]
+            if covered.shape != accepted.shape:
+                covered = covered.repeat(2, axis=0).repeat(2, axis=1)
+            leaf = (accepted >= 0) & ~covered
+            leaf_ys, leaf_xs = np.nonzero(leaf)
+            xs.append(leaf_xs << level)
+            ys.append(leaf_ys << level)
+            sizes.append(np.full(len(leaf_xs), 1 << level, dtype=np.intp))
+            indices.append(accepted[leaf_ys, leaf_xs])
+            covered |= leaf
+
+        xs, ys, sizes, indices = (np.concatenate(values) for values in (xs, ys, sizes, indices))
+        order = np.lexsort((xs, ys))
+        return xs[order], ys[order], sizes[order], sizes[order], indices[order]
+
+    @staticmethod
+    def rects_to_batch(xs: np.ndarray, ys: np.ndarray, widths: np.ndarray, heights: np.ndarray,
+                       indices: np.ndarray, templates: List[BlockTemplate]) -> BlockBatch:
+        """
+        将合并后的矩形转换为方块数据，每个矩形一个方块
+
+        方块以中心为锚点：坐标取矩形中心，水平、垂直方向对应的轴的缩放分别乘以宽、高
+
+        Args:
+            xs, ys: 矩形左下角的像素坐标
+            widths, heights: 矩形的宽、高 (像素)
+            indices: 模板在templates中的下标
+            templates: 可用模板列表
+
+        Returns:
+            BlockBatch: 方块批量数据，名称格式为 Pixel_{x}_{y}_{宽}x{高}
+        """
+        registry = TemplateRegistry.of(templates)
+
+        # 宽高为1时与逐像素转换的坐标和缩放完全一致
+        position = ImageBlockConverter.calculate_positions(xs + (widths - 1) / 2,
+                                                           ys + (heights - 1) / 2,
+                                                           Config.GLOBAL_SCALE)
+        scale = registry.scales[indices] * Config.GLOBAL_SCALE
+
+        # 图片的水平、垂直方向在坐标数组中对应的列
+        permutation = ImageBlockConverter.get_axis_permutation()
+        scale[:, permutation.index(0)] *= widths
+        scale[:, permutation.index(1)] *= heights
+
+        return BlockBatch(
+            template_id=registry.template_ids[indices],
+            position=position,
+            scale=scale,
+            name_format="Pixel_{0}_{1}_{2}x{3}",
+            name_args=np.stack((xs, ys, widths, heights), axis=-1)
+        )
+
+    @staticmethod
+    def pixels_to_merged_batch(pixels: Union[np.ndarray, List[List[Tuple[int, int, int, int]]]],
+                               templates: List[BlockTemplate],
+                               merge_mode: str) -> Tuple[BlockBatch, int]:
+        """
+        将像素颜色转换为方块数据，并把相同模板的相邻像素合并为拉伸的方块
+
+        Args:
+            pixels: 像素颜色数组
+            templates: 可用模板列表
+            merge_mode: 合并方式，'runs' 为按行合并，'rects' 为合并为矩形，'quadtree' 为四叉树分解
+
+        Returns:
+            (batch, pixel_count): 合并后的方块批量数据，以及合并前的不透明像素数量
+        """
+        index_grid = ImageBlockConverter.match_pixels(pixels, templates)
+        pixel_count = int(np.count_nonzero(index_grid >= 0))
+        rects = ImageBlockConverter.merge_pixels(pixels, index_grid, templates, merge_mode)
+        return ImageBlockConverter.rects_to_batch(*rects, templates), pixel_count
+
+    @staticmethod
+    def merge_pixels(pixels: Union[np.ndarray, List[List[Tuple[int, int, int, int]]]],
+                     index_grid: np.ndarray,
+                     templates: List[BlockTemplate],
+                     merge_mode: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        按合并方式把像素合并为矩形
+
+        Args:
+            pixels: 像素颜色数组
+            index_grid: match_pixels返回的 (height, width) 模板下标
+            templates: 可用模板列表
+            merge_mode: 合并方式，'runs'、'rects' 或 'quadtree'
+
+        Returns:
+            (xs, ys, widths, heights, indices): 合并后的矩形
+        """
+        if merge_mode == 'runs':
+            return ImageBlockConverter.merge_runs(index_grid)
+        if merge_mode == 'rects':
+            return ImageBlockConverter.merge_rects(index_grid)
+        if merge_mode == 'quadtree':
+            rgb = np.asarray(pixels, dtype=np.uint8).reshape(index_grid.shape + (4,))[..., :3]
+            return ImageBlockConverter.merge_quadtree(index_grid, rgb, templates, Config.QUADTREE_MAX_ERROR)
+        raise ValueError(f"未知的合并方式: {merge_mode}")
+
+    @staticmethod
+    def estimate_entity_count(img: Image.Image, templates: List[BlockTemplate]) -> int:
+        """
+        估算图片生成的实体数量，不创建方块数据也不组装
+
+        不合并时只统计不透明像素，合并时按Config.MERGE_MODE合并后统计矩形数量
+
+        Args:
+            img: 已调整大小的RGBA图片
+            templates: 可用模板列表
+
+        Returns:
+            int: 实体数量
+        """
+        pixels = ImageProcessor.get_pixel_array(img)
+        if Config.MERGE_MODE == 'none':
+            return int(np.count_nonzero(pixels[..., 3] >= Config.ALPHA_THRESHOLD))
+
+        index_grid = ImageBlockConverter.match_pixels(pixels, templates, verbose=False)
+        xs = ImageBlockConverter.merge_pixels(pixels, index_grid, templates, Config.MERGE_MODE)[0]
+        return len(xs)
+
+    @staticmethod
+    def _nearest_indices(source: int, target: int) -> np.ndarray:
+        """最近邻缩放时，目标的每一行 (列) 对应的原图行 (列) 下标"""
+        return np.minimum(((np.arange(target) + 0.5) * source / target).astype(np.intp), source - 1)
+
+    @staticmethod
+    def _fit_budget_size(img_width: int, img_height: int, max_entities: int, estimate, count,
+                         keep_aspect: bool = True, target_width: int = 0,
+                         target_height: int = 0) -> Tuple[int, int, int]:
+        """
+        选择实体数量不超过max_entities的最大分辨率 (长边不超过原图的长边)
+
+        先用estimate(width, height) 的快速估算二分查找长边，再用count(width, height) 精确统计，
+        超出时按实体数量与面积成正比缩小长边，直到不超过max_entities
+
+        Returns:
+            (width, height, entity_count): 分辨率及其精确的实体数量，最小分辨率仍超过max_entities时给出警告
+        """
+        if keep_aspect or target_width <= 0 or target_height <= 0:
+            base_width, base_height = img_width, img_height
+        else:
+            base_width, base_height = target_width, target_height
+        base_long_side = max(base_width, base_height)
+
+        def size(side: int) -> Tuple[int, int]:
+            return max(1, base_width * side // base_long_side), max(1, base_height * side // base_long_side)
+
+        # 二分查找长边的像素数
+        low, high = 1, max(img_width, img_height)
+        while low < high:
+            middle = (low + high + 1) // 2
+            estimated = estimate(*size(middle))
+            print(f"  {size(middle)[0]}x{size(middle)[1]}: 约 {estimated} 个实体")
+            if estimated <= max_entities:
+                low = middle
+            else:
+                high = middle - 1
+
+        side = low
+        entity_count = count(*size(side))
+        while entity_count > max_entities and side > 1:
+            side = max(1, min(side - 1, int(side * (max_entities / entity_count) ** 0.5)))
+            entity_count = count(*size(side))
+            print(f"  {size(side)[0]}x{size(side)[1]}: {entity_count} 个实体")
+
+        width, height = size(side)
+        if entity_count > max_entities:
+            print(f"Warning: 最小分辨率 {width}x{height} 仍有 {entity_count} 个实体，"
+                  f"超过最大实体数量 {max_entities}")
+        return width, height, entity_count
+
+    @staticmethod
+    def fit_entity_budget(img: Image.Image, max_entities: int, templates: List[BlockTemplate],
+                          keep_aspect: bool = True, target_width: int = 0,
+                          target_height: int = 0) -> Tuple[Image.Image, int]:
+        """
+        选择实体数量不超过max_entities的最大分辨率 (长边不超过原图的长边)
+
+        原图只匹配一次模板，二分查找时对模板下标做最近邻缩放后估算实体数量，
+        不在每一步重新缩放、匹配和合并；选定分辨率后再按实际缩放结果精确统计
+
+        Args:
+            img: 原始RGBA图片
+            max_entities: 最大实体数量
+            templates: 可用模板列表
+            keep_aspect: 是否保持原图宽高比，为False时拉伸为target_width:target_height的宽高比
+            target_width: 不保持宽高比时的目标宽度，只用于宽高比
+            target_height: 不保持宽高比时的目标高度，只用于宽高比
+
+        Returns:
+            (img_resized, entity_count): 调整后的图片及其实体数量，
+            最小分辨率仍超过max_entities时返回最小分辨率并给出警告
+        """
+        img_width, img_height = img.size
+        pixels = ImageProcessor.get_pixel_array(img)
+        index_grid = ImageBlockConverter.match_pixels(pixels, templates, verbose=False)
+
+        def estimate(width: int, height: int) -> int:
+            rows = ImageBlockConverter._nearest_indices(img_height, height)
+            columns = ImageBlockConverter._nearest_indices(img_width, width)
+            sampled = index_grid[np.ix_(rows, columns)]
+            if Config.MERGE_MODE == 'none':
+                return int(np.count_nonzero(sampled >= 0))
+            return len(ImageBlockConverter.merge_pixels(pixels[np.ix_(rows, columns)], sampled, templates,
+                                                        Config.MERGE_MODE)[0])
+
+        def count(width: int, height: int) -> int:
+            return ImageBlockConverter.estimate_entity_count(img.resize((width, height), Config.RESIZE_METHOD),
+                                                             templates)
+
+        width, height, entity_count = ImageBlockConverter._fit_budget_size(
+            img_width, img_height, max_entities, estimate, count, keep_aspect, target_width, target_height)
+        return img.resize((width, height), Config.RESIZE_METHOD), entity_count
+
+    @staticmethod
+    def fit_frames_entity_budget(frames: List[Image.Image], max_entities: int,
+                                 keep_aspect: bool = True, target_width: int = 0,
+                                 target_height: int = 0) -> Tuple[List[Image.Image], int]:
+        """
+        为动画选择实体数量不超过max_entities的最大分辨率
+
+        逐帧导出时每个像素固定使用一个实体，实体数量为任意一帧中不透明的像素数量
+
+        Args:
+            frames: 原始RGBA帧
+            max_entities: 最大实体数量
+            keep_aspect: 是否保持原图宽高比，为False时拉伸为target_width:target_height的宽高比
+            target_width: 不保持宽高比时的目标宽度，只用于宽高比
+            target_height: 不保持宽高比时的目标高度，只用于宽高比
+
+        Returns:
+            (frames_resized, entity_count): 调整后的每一帧及实体数量
+        """
+        img_width, img_height = frames[0].size
+        opaque = np.zeros((img_height, img_width), dtype=bool)
+        for frame in frames:
+            opaque |= ImageProcessor.get_pixel_array(frame)[..., 3] >= Config.ALPHA_THRESHOLD
+
+        def estimate(width: int, height: int) -> int:
+            rows = ImageBlockConverter._nearest_indices(img_height, height)
+            columns = ImageBlockConverter._nearest_indices(img_width, width)
+            return int(np.count_nonzero(opaque[np.ix_(rows, columns)]))
+
+        def count(width: int, height: int) -> int:
+            resized = np.zeros((height, width), dtype=bool)
+            for frame in frames:
+                alpha = ImageProcessor.get_pixel_array(frame.resize((width, height), Config.RESIZE_METHOD))[..., 3]
+                resized |= alpha >= Config.ALPHA_THRESHOLD
+            return int(np.count_nonzero(resized))
+
+        width, height, entity_count = ImageBlockConverter._fit_budget_size(
+            img_width, img_height, max_entities, estimate, count, keep_aspect, target_width, target_height)
+        return [frame.resize((width, height), Config.RESIZE_METHOD) for frame in frames], entity_count
+
+
+def allocate_entity_id_start(count: int, output_path: str, reserved_ids: Optional[np.ndarray] = None) -> int:
+    """
+    获取本次生成的起始实体ID，未设置ENTITY_ID_DB时为ENTITY_ID_START
+
+    Args:
+        count: 需要的实体ID数量
+        output_path: 本次将被覆盖的输出文件或目录，不扫描
+        reserved_ids: 分配前登记为已占用的实体ID，增量生成时为沿用的实体ID
+    """
+    if not Config.ENTITY_ID_DB:
+        return Config.ENTITY_ID_START
+    return EntityIdAllocator.allocate_for_run(Config.ENTITY_ID_DB, Config.ENTITY_ID_SCAN_PATHS,
+                                              count, Config.ENTITY_ID_START, exclude=[output_path],
+                                              reserved_ids=reserved_ids)
+
+
+def save_frame(batch: BlockBatch, filename: str, use_wire_encoder: bool) -> bool:
+    """
+    保存一帧的方块数据，实体ID已在batch中指定，可在子进程中运行
+
+    Args:
+        batch: 方块数据
+        filename: 保存的文件路径
+        use_wire_encoder: 是否直接编码线格式
+
+    Returns:
+        bool: 保存是否成功
+    """
+    assembler = BlockAssembler(entity_id_start=Config.ENTITY_ID_START, use_wire_encoder=use_wire_encoder)
+    return assembler.assemble_to_file(batch, filename)
+
+
+def export_frames(image_path: str):
+    """
+    逐帧导出动画图片，每帧一个GIA文件，只包含与上一帧相比模板改变的方块
+
+    每个像素在所有帧中固定使用一个实体，因此不支持MERGE_MODE和INCREMENTAL，设置时给出警告
+    """
+    if Config.MERGE_MODE != 'none':
+        print(f"Warning: 逐帧导出时每个像素固定对应一个实体，忽略合并方式 {Config.MERGE_MODE}，不合并像素")
+    if Config.INCREMENTAL:
+        print("Warning: 逐帧导出不支持增量生成，忽略INCREMENTAL，重新生成所有帧")
+
+    print("加载动画帧...")
+    try:
+        if Config.MAX_ENTITY_COUNT > 0:
+            print(f"按最大实体数量 {Config.MAX_ENTITY_COUNT} 选择分辨率...")
+            frames, entity_count = ImageBlockConverter.fit_frames_entity_budget(
+                ImageProcessor.load_frames(image_path),
+                Config.MAX_ENTITY_COUNT,
+                keep_aspect=Config.KEEP_ASPECT_RATIO,
+                target_width=Config.OUTPUT_WIDTH,
+                target_height=Config.OUTPUT_HEIGHT
+            )
+            print(f"预计实体数量: {entity_count}")
+        else:
+            frames = ImageProcessor.load_frames_and_resize(
+                image_path,
+                Config.OUTPUT_WIDTH,
+                Config.OUTPUT_HEIGHT,
+                keep_aspect=Config.KEEP_ASPECT_RATIO,
+                resize_method=Config.RESIZE_METHOD
+            )
+    except Exception as e:
+        print(f"Error: 处理图片失败: {e}")
+        return
+    width, height = frames[0].size
+    print(f"共 {len(frames)} 帧，已调整为: {width}x{height} 像素")
+    print()
+
+    print("逐帧比较...")
+    pixels = np.stack([ImageProcessor.get_pixel_array(frame) for frame in frames])
+    output_dir = "output/image_frames"
+    entity_id_start = allocate_entity_id_start(width * height, output_dir)
+    batches, removed_counts = ImageBlockConverter.frames_to_batches(pixels, BlockConfig.AVAILABLE_BLOCKS,
+                                                                    entity_id_start)
+    for index, (batch, removed) in enumerate(zip(batches, removed_counts)):
+        message = f"  第 {index} 帧: {len(batch)} 个方块"
+        if removed:
+            message += f"，{removed} 个像素变为透明 (GIA无法删除实体，保持上一帧的方块)"
+        print(message)
+    print()
+
+    print("组装实体并保存...")
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = [os.path.join(output_dir, f"frame_{index:04d}.gia") for index in range(len(batches))]
+
+    # 各帧的实体ID已确定，可以并行组装；单进程或方块数量较少时启动进程池得不偿失，直接逐帧保存
+    use_wire_encoders = [Config.USE_WIRE_ENCODER] * len(batches)
+    total_blocks = sum(len(batch) for batch in batches)
+    if Config.ASSEMBLE_WORKERS <= 1 or len(batches) <= 1 or total_blocks <= BlockAssembler.PARALLEL_SHARD_SIZE:
+        results = list(map(save_frame, batches, filenames, use_wire_encoders))
+    else:
+        with ProcessPoolExecutor(max_workers=min(Config.ASSEMBLE_WORKERS, len(batches))) as executor:
+            results = list(executor.map(save_frame, batches, filenames, use_wire_encoders))
+
+    if all(results):
+        print()
+        print("=" * 70)
+        print("生成完成！")
+        print("=" * 70)
+        print(f"输入图片: {image_path}")
+        print(f"帧数: {len(frames)}")
+        print(f"输出分辨率: {width}x{height} 方块")
+        print(f"输出目录: {output_dir}")
+        print(f"方块总数: {total_blocks}")
+        print(f"实体ID范围: {entity_id_start} - {entity_id_start + width * height - 1}")
+        print()
+    else:
+        print("Error: 保存失败")
+
 
 def apply_config(config_dict: dict):
     """将配置字典应用到Config类"""
     Config.OUTPUT_WIDTH = config_dict['OUTPUT_WIDTH']
     Config.OUTPUT_HEIGHT = config_dict['OUTPUT_HEIGHT']
+    Config.MAX_ENTITY_COUNT = config_dict['MAX_ENTITY_COUNT']
     Config.KEEP_ASPECT_RATIO = config_dict['KEEP_ASPECT_RATIO']
     Config.GLOBAL_SCALE = config_dict['GLOBAL_SCALE']
     Config.START_POSITION = config_dict['START_POSITION']
     Config.AXIS_MAPPING = config_dict['AXIS_MAPPING']
     Config.ALPHA_THRESHOLD = config_dict['ALPHA_THRESHOLD']
+    Config.MERGE_MODE = config_dict['MERGE_MODE']
+    Config.QUADTREE_MAX_ERROR = config_dict['QUADTREE_MAX_ERROR']
     Config.ENTITY_ID_START = config_dict['ENTITY_ID_START']
 
 
@@ -336,7 +1179,12 @@ def main():
     apply_config(user_config)
 
     print("当前配置:")
-    print(f"  输出分辨率: {Config.OUTPUT_WIDTH}x{Config.OUTPUT_HEIGHT}")
+    if Config.MAX_ENTITY_COUNT > 0:
+        print(f"  最大实体数量: {Config.MAX_ENTITY_COUNT}")
+        if not Config.KEEP_ASPECT_RATIO:
+            print(f"  拉伸后的宽高比: {Config.OUTPUT_WIDTH}:{Config.OUTPUT_HEIGHT}")
+    else:
+        print(f"  输出分辨率: {Config.OUTPUT_WIDTH}x{Config.OUTPUT_HEIGHT}")
     print(f"  保持宽高比: {'是' if Config.KEEP_ASPECT_RATIO else '否'}")
     print(f"  全局缩放: {Config.GLOBAL_SCALE}")
     print(f"  起始位置: X={Config.START_POSITION['x']}, "
@@ -345,6 +1193,7 @@ def main():
     print(f"  坐标映射: 水平→{Config.AXIS_MAPPING['horizontal']}, "
           f"垂直→{Config.AXIS_MAPPING['vertical']}, "
           f"深度→{Config.AXIS_MAPPING['depth']}")
+    print(f"  合并方式: {Config.MERGE_MODE}")
     print()
 
     print("选择图片文件...")
@@ -357,15 +1206,34 @@ def main():
     print(f"已选择图片: {image_path}")
     print()
 
+    frame_count = ImageProcessor.get_frame_count(image_path)
+    if frame_count > 1:
+        export_all = ask_input(f"检测到 {frame_count} 帧动画，是否逐帧导出 (是/否)", True,
+                               lambda x: x.lower() in ('y', 'yes', '是', '1', ''))
+        print()
+        if export_all:
+            export_frames(image_path)
+            return
+
     print("加载并处理图片...")
     try:
-        img = ImageProcessor.load_and_resize(
-            image_path,
-            Config.OUTPUT_WIDTH,
-            Config.OUTPUT_HEIGHT,
-            keep_aspect=Config.KEEP_ASPECT_RATIO,
-            resize_method=Config.RESIZE_METHOD
-        )
+        if Config.MAX_ENTITY_COUNT > 0:
+            print(f"按最大实体数量 {Config.MAX_ENTITY_COUNT} 选择分辨率...")
+            img, entity_count = ImageBlockConverter.fit_entity_budget(ImageProcessor.load(image_path),
+                                                                      Config.MAX_ENTITY_COUNT,
+                                                                      BlockConfig.AVAILABLE_BLOCKS,
+                                                                      keep_aspect=Config.KEEP_ASPECT_RATIO,
+                                                                      target_width=Config.OUTPUT_WIDTH,
+                                                                      target_height=Config.OUTPUT_HEIGHT)
+            print(f"预计实体数量: {entity_count}")
+        else:
+            img = ImageProcessor.load_and_resize(
+                image_path,
+                Config.OUTPUT_WIDTH,
+                Config.OUTPUT_HEIGHT,
+                keep_aspect=Config.KEEP_ASPECT_RATIO,
+                resize_method=Config.RESIZE_METHOD
+            )
         actual_width, actual_height = img.size
         print(f"图片已调整为: {actual_width}x{actual_height} 像素")
 
@@ -379,11 +1247,18 @@ def main():
         return
     print()
 
-    pixels = ImageProcessor.get_pixel_colors(img)
+    pixels = ImageProcessor.get_pixel_array(img)
 
     try:
-        blocks = ImageBlockConverter.pixels_to_blocks(pixels, BlockConfig.AVAILABLE_BLOCKS)
-        print(f"成功转换 {len(blocks)} 个方块")
+        if Config.MERGE_MODE == 'none':
+            blocks = ImageBlockConverter.pixels_to_batch(pixels, BlockConfig.AVAILABLE_BLOCKS)
+            print(f"成功转换 {len(blocks)} 个方块")
+        else:
+            blocks, pixel_count = ImageBlockConverter.pixels_to_merged_batch(
+                pixels, BlockConfig.AVAILABLE_BLOCKS, Config.MERGE_MODE
+            )
+            reduction = 1 - len(blocks) / pixel_count if pixel_count else 0.0
+            print(f"成功转换 {len(blocks)} 个方块 (合并前 {pixel_count} 个，实体数量减少 {reduction * 100:.1f}%)")
     except Exception as e:
         print(f"Error: 转换失败: {e}")
         import traceback
@@ -393,12 +1268,11 @@ def main():
 
     # 统计模板使用情况
     print("方块模板使用统计:")
-    template_stats = {}
-    for block in blocks:
-        template_stats[block.template_id] = template_stats.get(block.template_id, 0) + 1
+    template_stats = BlockHelper.count_templates(blocks.template_id)
 
+    registry = TemplateRegistry.default()
     for template_id, count in sorted(template_stats.items(), key=lambda x: -x[1])[:10]:
-        template = next((t for t in BlockConfig.AVAILABLE_BLOCKS if t.template_id == template_id), None)
+        template = registry.get(template_id)
         if template:
             percentage = (count / len(blocks)) * 100
             print(f"  模板 {template_id} RGB{template.color_tuple}: "
@@ -410,11 +1284,38 @@ def main():
 
     # 组装并保存
     print("组装实体并保存...")
-    assembler = BlockAssembler(entity_id_start=Config.ENTITY_ID_START)
-    proto_data = assembler.assemble(blocks)
+    output_filename = "output/image_pixelart.gia"
+    previous_data = None
+    if Config.INCREMENTAL and os.path.exists(output_filename):
+        previous_data, header = FileHelper.load_mapped(output_filename)
+        if not header.valid:
+            print(f"Error: 上一次的输出格式不正确，重新生成: {output_filename}")
+            previous_data = None
+    incremental = previous_data is not None
+
+    if incremental:
+        # 沿用上一次的实体ID，只为新增的方块分配实体ID
+        assembler = BlockAssembler(entity_id_start=Config.ENTITY_ID_START,
+                                   use_wire_encoder=Config.USE_WIRE_ENCODER)
+
+        def allocate_ids(count: int, used_ids: np.ndarray) -> int:
+            return allocate_entity_id_start(count, output_filename, used_ids)
+
+        proto_data, report = assembler.assemble_incremental(blocks, previous_data,
+                                                            allocate_ids if Config.ENTITY_ID_DB else None)
+        # 释放映射后再替换文件
+        previous_data.release()
+        print(f"增量生成: {report.summary()}")
+        report_filename = "output/image_pixelart.report.txt"
+        report.save(report_filename)
+        print(f"变化报告: {report_filename}")
+    else:
+        entity_id_start = allocate_entity_id_start(len(blocks), output_filename)
+        assembler = BlockAssembler(entity_id_start=entity_id_start,
+                                   use_wire_encoder=Config.USE_WIRE_ENCODER)
+        proto_data = assembler.assemble(blocks, parallel=Config.ASSEMBLE_WORKERS)
     print(f"Protobuf数据大小: {len(proto_data)} 字节")
 
-    output_filename = f"output/image_pixelart.gia"
     success = FileHelper.save(proto_data, output_filename)
 
     if success:
@@ -427,13 +1328,16 @@ def main():
         print(f"输出分辨率: {actual_width}x{actual_height} 方块")
         print(f"方块总数: {len(blocks)}")
         print(f"使用模板种类: {len(template_stats)}")
-        print(f"实体ID范围: {Config.ENTITY_ID_START} - {assembler.current_entity_id - 1}")
+        if not incremental:
+            print(f"实体ID范围: {entity_id_start} - {assembler.current_entity_id - 1}")
         print()
     else:
         print("Error: 保存失败")
 
 
 if __name__ == "__main__":
+    # 打包为exe后，多进程组装的子进程不会重新执行main()
+    multiprocessing.freeze_support()
     try:
         main()
     except KeyboardInterrupt:
@@ -10,12 +10,18 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../proto_gen"))
 
 import json
-from typing import List
+import multiprocessing
+from typing import List, Optional, Tuple
 
+import numpy as np
+
+from model.block_batch import BlockBatch
 from model.block_model import BlockModel
 from assembler.block_assembler import BlockAssembler
+from helper.entity_id_allocator import EntityIdAllocator
 from helper.file_helper import FileHelper
 from helper.block_helper import BlockHelper
+from helper.template_registry import TemplateRegistry
 from config.block_config import BlockTemplate, BlockConfig
 
 
@@ -32,6 +38,32 @@ class Config:
     # 实体ID起始值
     ENTITY_ID_START = 1078000000
 
+    # 实体ID分配数据库，非空时从ENTITY_ID_START开始分配未被占用的实体ID，避开ENTITY_ID_SCAN_PATHS中已有文件和其他生成器的实体ID
+    ENTITY_ID_DB = ""
+    ENTITY_ID_SCAN_PATHS = ["../output"]
+
+    # 使用磁盘缓存的颜色查找表匹配模板 (首次使用时自动构建)
+    USE_COLOR_LUT = False
+
+    # 剔除被完全包围的内部方块，只保留CULL_SHELL_THICKNESS层外壳
+    CULL_HIDDEN_VOXELS = False
+    CULL_SHELL_THICKNESS = 1
+
+    # 合并相同模板的相邻方块以减少实体数量: 'none' 不合并, 'cuboids' 合并为长方体
+    MERGE_MODE = 'none'
+
+    # 合并和剔除使用包围盒大小的稠密网格，包围盒格数超过此值时 (坐标稀疏分布) 不合并、不剔除
+    MAX_GRID_VOLUME = 1 << 27
+
+    # 直接编码protobuf线格式，不创建消息对象 (输出与消息路径逐字节一致)
+    USE_WIRE_ENCODER = True
+
+    # 序列化使用的进程数，方块数量较少时自动使用单进程
+    ASSEMBLE_WORKERS = os.cpu_count() or 1
+
+    # 输出文件已存在时增量生成: 沿用同一网格位置的实体ID，未改变的实体直接复制上一次的字节
+    INCREMENTAL = False
+
     # 输入文件路径
     input_file = "../output/model_voxels.json"
 
@@ -39,13 +71,15 @@ class Config:
     output_file = "../output/voxel_model.gia"
 
 
-def json_to_block_data(json_block: dict, templates: List[BlockTemplate]) -> BlockModel:
+def json_to_block_data(json_block: dict, templates: List[BlockTemplate],
+                       template: Optional[BlockTemplate] = None) -> BlockModel:
     """
     将JSON方块数据转换为BlockData
 
     Args:
         json_block: JSON数据，包含 x, y, z, color
         templates: 可用模板列表
+        template: 已匹配好的模板，为None时根据颜色查找
 
     Returns:
         BlockData: 方块数据对象
@@ -57,10 +91,12 @@ def json_to_block_data(json_block: dict, templates: List[BlockTemplate]) -> Bloc
     color = json_block['color']
 
     # 找到最匹配的模板模板
-    template = BlockHelper.find_closest_template(color, templates)
+    if template is None:
+        template = BlockHelper.find_closest_template(color, templates)
 
-    # 计算缩放
-    scale_x, scale_y, scale_z = BlockHelper.calculate_scale(template, Config.GLOBAL_SCALE)
+    # 从注册表读取预计算的缩放
+    registry = TemplateRegistry.of(templates)
+    scale_x, scale_y, scale_z = registry.get_scale(registry.get(template.template_id).index, Config.GLOBAL_SCALE)
 
     # 计算位置
     position_x, position_y, position_z = BlockHelper.calculate_position(x, y, z, Config.GLOBAL_SCALE,
@@ -84,6 +120,241 @@ def json_to_block_data(json_block: dict, templates: List[BlockTemplate]) -> Bloc
     return block_data
 
 
+def json_to_batch(json_blocks: List[dict], templates: List[BlockTemplate]) -> BlockBatch:
+    """
+    将JSON方块数据批量转换为列式存储的BlockBatch，结果与逐个调用json_to_block_data一致
+
+    Args:
+        json_blocks: JSON数据列表，每项包含 x, y, z, color
+        templates: 可用模板列表
+
+    Returns:
+        BlockBatch: 方块批量数据，名称格式为 Block_{x}_{y}_{z}
+    """
+    registry = TemplateRegistry.of(templates)
+    coords, template_indices = match_voxels(json_blocks, templates)
+
+    start = np.array([Config.START_POSITION['x'], Config.START_POSITION['y'], Config.START_POSITION['z']])
+
+    return BlockBatch(
+        template_id=registry.template_ids[template_indices],
+        position=start + coords * Config.GLOBAL_SCALE,
+        scale=registry.scales[template_indices] * Config.GLOBAL_SCALE,
+        name_format="Block_{0}_{1}_{2}",
+        name_args=coords
+    )
+
+
+def get_voxel_coords(json_blocks: List[dict]) -> np.ndarray:
+    """
+    读取JSON方块数据的整数坐标
+
+    Args:
+        json_blocks: JSON数据列表，每项包含 x, y, z
+
+    Returns:
+        np.ndarray: (N, 3) 整数坐标
+    """
+    return np.array([(int(json_block['x']), int(json_block['y']), int(json_block['z']))
+                     for json_block in json_blocks], dtype=np.int64).reshape(-1, 3)
+
+
+def cull_hidden_voxels(coords: np.ndarray, shell_thickness: int = 1) -> np.ndarray:
+    """
+    剔除被完全包围、不可见的内部方块
+
+    在包围盒大小 (外扩一格) 的占用网格上，用6个方向平移后的网格做与运算，
+    每做一次相当于向内腐蚀一层，腐蚀shell_thickness次后剩下的方块即为要剔除的内部方块。
+    包围盒格数超过Config.MAX_GRID_VOLUME时改为在排序后的坐标编号上查找6个相邻方块
+
+    Args:
+        coords: (N, 3) 方块的整数坐标
+        shell_thickness: 保留的外壳厚度 (方块数)，为1时只保留表面
+
+    Returns:
+        np.ndarray: (N,) 布尔数组，需要保留的方块为True
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+    if len(coords) == 0 or shell_thickness < 1:
+        return np.ones(len(coords), dtype=bool)
+
+    # 外扩一格，包围盒边界上的方块总有一侧为空
+    local = coords - coords.min(axis=0) + 1
+    shape = local.max(axis=0) + 2
+
+    volume = int(np.prod(shape, dtype=object))
+    if volume > Config.MAX_GRID_VOLUME:
+        if volume >= 1 << 62:
+            print(f"Warning: 包围盒 {shape[0]}x{shape[1]}x{shape[2]} 过大，不剔除内部方块")
+            return np.ones(len(coords), dtype=bool)
+
+        # 按 [x, y, z] 展平的格子编号，外扩的一格保证相邻编号不会跨行
+        strides = np.array([shape[1] * shape[2], shape[2], 1], dtype=np.int64)
+        keys = local @ strides
+        interior = np.unique(keys)
+        for _ in range(shell_thickness):
+            inside = np.ones(len(interior), dtype=bool)
+            for stride in strides:
+                inside &= np.isin(interior + stride, interior, assume_unique=True)
+                inside &= np.isin(interior - stride, interior, assume_unique=True)
+            interior = interior[inside]
+            if len(interior) == 0:
+                break
+        return ~np.isin(keys, interior)
+
+    occupied = np.zeros(tuple(shape), dtype=bool)
+    occupied[local[:, 0], local[:, 1], local[:, 2]] = True
+
+    interior = occupied
+    for _ in range(shell_thickness):
+        core = interior[1:-1, 1:-1, 1:-1]
+        eroded = np.zeros_like(interior)
+        eroded[1:-1, 1:-1, 1:-1] = (core
+                                    & interior[:-2, 1:-1, 1:-1] & interior[2:, 1:-1, 1:-1]
+                                    & interior[1:-1, :-2, 1:-1] & interior[1:-1, 2:, 1:-1]
+                                    & interior[1:-1, 1:-1, :-2] & interior[1:-1, 1:-1, 2:])
+        interior = eroded
+        if not interior.any():
+            break
+
+    return ~interior[local[:, 0], local[:, 1], local[:, 2]]
+
+
+def match_voxels(json_blocks: List[dict], templates: List[BlockTemplate]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取JSON方块数据的坐标，并为每个方块匹配模板
+
+    Args:
+        json_blocks: JSON数据列表，每项包含 x, y, z, color
+        templates: 可用模板列表
+
+    Returns:
+        (coords, template_indices): (N, 3) 整数坐标，(N,) 模板在templates中的下标
+    """
+    coords = get_voxel_coords(json_blocks)
+    colors = np.array([BlockHelper.hex_to_rgb(json_block['color']) for json_block in json_blocks],
+                      dtype=np.uint8).reshape(-1, 3)
+
+    # 颜色去重后一次性批量查找所有方块最匹配的模板
+    template_indices, unique_count = BlockHelper.match_unique_colors(colors, templates,
+                                                                     use_lut=Config.USE_COLOR_LUT)
+    print(f"颜色去重: {len(colors)} 个方块共 {unique_count} 种颜色")
+
+    return coords, template_indices
+
+
+def merge_cuboids(coords: np.ndarray, template_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    把相同模板的相邻方块贪心合并为长方体
+
+    在包围盒大小的稠密网格中按 z、y 的顺序逐行扫描，先把行中连续的同模板方块切分为若干段，
+    以每段为长方体沿x的边，再沿y延伸整段，最后沿z延伸整个矩形，覆盖后继续扫描。
+    坐标重复时只保留最后一个方块。包围盒格数超过Config.MAX_GRID_VOLUME时不合并，每个方块单独作为长方体
+
+    Args:
+        coords: (N, 3) 方块的整数坐标
+        template_indices: (N,) 模板下标
+
+    Returns:
+        (mins, sizes, indices): 每个长方体的最小角坐标 (M, 3)、各轴长度 (M, 3) 和模板下标 (M,)
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+    template_indices = np.asarray(template_indices, dtype=np.intp).reshape(-1)
+    if len(coords) == 0:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.intp)
+
+    origin = coords.min(axis=0)
+    local = coords - origin
+    extent = local.max(axis=0) + 1
+
+    volume = int(np.prod(extent, dtype=object))
+    if volume > Config.MAX_GRID_VOLUME:
+        print(f"Warning: 包围盒 {extent[0]}x{extent[1]}x{extent[2]} 超过 {Config.MAX_GRID_VOLUME} 格，不合并方块")
+        # 坐标重复时保留最后一个方块，与合并时一致
+        _, last = np.unique(coords[::-1], axis=0, return_index=True)
+        last = np.sort(len(coords) - 1 - last)
+        return coords[last], np.ones((len(last), 3), dtype=np.int64), template_indices[last]
+
+    # 网格按 [z, y, x] 存储，x方向连续
+    grid = np.full((extent[2], extent[1], extent[0]), -1, dtype=np.int32)
+    grid[local[:, 2], local[:, 1], local[:, 0]] = template_indices
+
+    cuboids = []
+    for z, y in zip(*np.nonzero((grid >= 0).any(axis=2))):
+        # 之前的长方体可能已覆盖本行的部分方块，按覆盖后的行切分，
+        # 本行开始的长方体只覆盖各自的段，不影响其余段
+        row = grid[z, y]
+        xs = np.flatnonzero(row >= 0)
+        if len(xs) == 0:
+            continue
+        selected = row[xs]
+
+        # 不相邻或模板不同的方块开始新的一段
+        starts = np.ones(len(xs), dtype=bool)
+        starts[1:] = (xs[1:] != xs[:-1] + 1) | (selected[1:] != selected[:-1])
+        starts = np.flatnonzero(starts)
+        widths = np.diff(np.append(starts, len(xs)))
+
+        for x, width, template_index in zip(xs[starts].tolist(), widths.tolist(), selected[starts].tolist()):
+            # 沿y延伸整段
+            rows = (grid[z, y:, x:x + width] == template_index).all(axis=1)
+            height = len(rows) if rows.all() else int(np.argmin(rows))
+
+            # 沿z延伸整个矩形
+            layers = (grid[z:, y:y + height, x:x + width] == template_index).all(axis=(1, 2))
+            depth = len(layers) if layers.all() else int(np.argmin(layers))
+
+            grid[z:z + depth, y:y + height, x:x + width] = -1
+            cuboids.append((x, y, z, width, height, depth, template_index))
+
+    cuboids = np.array(cuboids, dtype=np.int64).reshape(-1, 7)
+    return cuboids[:, 0:3] + origin, cuboids[:, 3:6], cuboids[:, 6].astype(np.intp)
+
+
+def cuboids_to_batch(mins: np.ndarray, sizes: np.ndarray, template_indices: np.ndarray,
+                     templates: List[BlockTemplate]) -> BlockBatch:
+    """
+    将合并后的长方体转换为方块数据，每个长方体一个方块
+
+    方块以中心为锚点：坐标取长方体中心，各轴缩放乘以对应的长度，
+    长度为1时与逐个方块转换的坐标和缩放一致
+
+    Args:
+        mins: (M, 3) 长方体的最小角坐标
+        sizes: (M, 3) 长方体各轴长度
+        template_indices: (M,) 模板下标
+        templates: 可用模板列表
+
+    Returns:
+        BlockBatch: 方块批量数据，名称格式为 Block_{x}_{y}_{z}_{长}x{宽}x{高}
+    """
+    registry = TemplateRegistry.of(templates)
+    start = np.array([Config.START_POSITION['x'], Config.START_POSITION['y'], Config.START_POSITION['z']])
+
+    return BlockBatch(
+        template_id=registry.template_ids[template_indices],
+        position=start + (mins + (sizes - 1) / 2) * Config.GLOBAL_SCALE,
+        scale=registry.scales[template_indices] * Config.GLOBAL_SCALE * sizes,
+        name_format="Block_{0}_{1}_{2}_{3}x{4}x{5}",
+        name_args=np.concatenate((mins, sizes), axis=1)
+    )
+
+
+def json_to_merged_batch(json_blocks: List[dict], templates: List[BlockTemplate]) -> BlockBatch:
+    """
+    将JSON方块数据转换为方块数据，并把相同模板的相邻方块合并为长方体
+
+    Args:
+        json_blocks: JSON数据列表，每项包含 x, y, z, color
+        templates: 可用模板列表
+
+    Returns:
+        BlockBatch: 合并后的方块批量数据
+    """
+    coords, template_indices = match_voxels(json_blocks, templates)
+    return cuboids_to_batch(*merge_cuboids(coords, template_indices), templates)
+
+
 def load_json_file(filepath: str) -> List[dict]:
     """
     加载JSON文件
@@ -103,6 +374,21 @@ def load_json_file(filepath: str) -> List[dict]:
         raise ValueError("JSON格式不支持，应为数组")
 
 
+def allocate_entity_id_start(count: int, reserved_ids: Optional[np.ndarray] = None) -> int:
+    """
+    获取本次生成的起始实体ID，未设置ENTITY_ID_DB时为ENTITY_ID_START，不扫描将被覆盖的输出文件
+
+    Args:
+        count: 需要的实体ID数量
+        reserved_ids: 分配前登记为已占用的实体ID，增量生成时为沿用的实体ID
+    """
+    if not Config.ENTITY_ID_DB:
+        return Config.ENTITY_ID_START
+    return EntityIdAllocator.allocate_for_run(Config.ENTITY_ID_DB, Config.ENTITY_ID_SCAN_PATHS,
+                                              count, Config.ENTITY_ID_START, exclude=[Config.output_file],
+                                              reserved_ids=reserved_ids)
+
+
 def main():
     print("=" * 70)
     print("JSON数据转方块生成器")
@@ -116,6 +402,11 @@ def main():
     print(f"  起始位置: X={Config.START_POSITION['x']}, "
           f"Y={Config.START_POSITION['y']}, "
           f"Z={Config.START_POSITION['z']}")
+    if Config.CULL_HIDDEN_VOXELS:
+        print(f"  剔除内部方块: 是 (外壳厚度 {Config.CULL_SHELL_THICKNESS})")
+    else:
+        print("  剔除内部方块: 否")
+    print(f"  合并方式: {Config.MERGE_MODE}")
     print()
 
     print("读取JSON文件...")
@@ -130,40 +421,66 @@ def main():
         return
     print()
 
-    print("转换为方块数据...")
-    blocks = []
-    color_stats = {}  # 统计每种模板使用次数
-
-    for i, json_block in enumerate(json_blocks):
-        block_data = json_to_block_data(
-            json_block,
-            BlockConfig.AVAILABLE_BLOCKS
-        )
-        blocks.append(block_data)
+    if Config.CULL_HIDDEN_VOXELS:
+        print("剔除内部方块...")
+        keep = cull_hidden_voxels(get_voxel_coords(json_blocks), Config.CULL_SHELL_THICKNESS)
+        culled_count = len(json_blocks) - int(np.count_nonzero(keep))
+        json_blocks = [json_blocks[i] for i in np.flatnonzero(keep).tolist()]
+        print(f"剔除 {culled_count} 个内部方块，剩余 {len(json_blocks)} 个方块")
+        print()
 
-        # 统计
-        template_id = block_data.template_id
-        color_stats[template_id] = color_stats.get(template_id, 0) + 1
+    print("转换为方块数据...")
+    if Config.MERGE_MODE == 'cuboids':
+        blocks = json_to_merged_batch(json_blocks, BlockConfig.AVAILABLE_BLOCKS)
+    else:
+        blocks = json_to_batch(json_blocks, BlockConfig.AVAILABLE_BLOCKS)
+    color_stats = BlockHelper.count_templates(blocks.template_id)  # 统计每种模板使用次数
 
     print(f"共转换 {len(blocks)} 个方块")
+    if Config.MERGE_MODE == 'cuboids' and json_blocks:
+        reduction = 1 - len(blocks) / len(json_blocks)
+        print(f"合并为长方体: {len(json_blocks)} 个方块 → {len(blocks)} 个实体 (减少 {reduction * 100:.1f}%)")
     print()
 
     print("方块使用统计:")
+    registry = TemplateRegistry.default()
     for template_id, count in color_stats.items():
         # 找到对应的模板
-        template = next((t for t in BlockConfig.AVAILABLE_BLOCKS if t.template_id == template_id), None)
+        template = registry.get(template_id)
         if template:
             rgb = template.color_tuple
             print(f"  模板 {template_id} (RGB{rgb}): {count} 个")
     print()
 
-    print("组装Proto...")
-    assembler = BlockAssembler(entity_id_start=Config.ENTITY_ID_START)
-    proto_data = assembler.assemble(blocks)
-    print(f"Protobuf数据大小: {len(proto_data)} 字节")
-    print()
-
-    success = FileHelper.save(proto_data, Config.output_file)
+    print("组装Proto并保存...")
+    previous_data = None
+    if Config.INCREMENTAL and os.path.exists(Config.output_file):
+        previous_data, header = FileHelper.load_mapped(Config.output_file)
+        if not header.valid:
+            print(f"Error: 上一次的输出格式不正确，重新生成: {Config.output_file}")
+            previous_data = None
+    incremental = previous_data is not None
+
+    if incremental:
+        # 沿用上一次的实体ID，只为新增的方块分配实体ID
+        assembler = BlockAssembler(entity_id_start=Config.ENTITY_ID_START,
+                                   use_wire_encoder=Config.USE_WIRE_ENCODER)
+        allocate_ids = allocate_entity_id_start if Config.ENTITY_ID_DB else None
+        proto_data, report = assembler.assemble_incremental(blocks, previous_data, allocate_ids)
+        # 释放映射后再替换文件
+        previous_data.release()
+        print(f"增量生成: {report.summary()}")
+        report_file = os.path.splitext(Config.output_file)[0] + ".report.txt"
+        report.save(report_file)
+        print(f"变化报告: {report_file}")
+        success = FileHelper.save(proto_data, Config.output_file)
+    else:
+        entity_id_start = allocate_entity_id_start(len(blocks))
+        assembler = BlockAssembler(entity_id_start=entity_id_start,
+                                   use_wire_encoder=Config.USE_WIRE_ENCODER)
+        # 边编码边写入，不在内存中保存完整的protobuf数据
+        success = assembler.assemble_to_file(blocks, Config.output_file,
+                                              parallel=Config.ASSEMBLE_WORKERS)
 
     if success:
         print()
@@ -173,8 +490,9 @@ def main():
         print(f"输入文件: {Config.input_file}")
         print(f"输出文件: {Config.output_file}")
         print(f"方块数量: {len(blocks)}")
-        print(f"实体ID范围: {Config.ENTITY_ID_START} - "
-              f"{assembler.current_entity_id - 1}")
+        if not incremental:
+            print(f"实体ID范围: {entity_id_start} - "
+                  f"{assembler.current_entity_id - 1}")
         print(f"全局缩放: {Config.GLOBAL_SCALE}")
         print()
     else:
@@ -182,6 +500,8 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包为exe后，多进程组装的子进程不会重新执行main()
+    multiprocessing.freeze_support()
     try:
         main()
     except KeyboardInterrupt:
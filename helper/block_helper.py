@@ -6,14 +6,26 @@
 """
 import colorsys
 import math
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
 
-from config.block_config import BlockTemplate, BlockConfig
+import numpy as np
+
+from config.block_config import BlockTemplate
+from helper.template_registry import TemplateRegistry
 
 
 class BlockHelper:
     """方块数据转换器"""
 
+    # 最近与次近距离之差小于该值时视为并列，回退到逐个匹配以保证结果与find_closest_template_rgb一致
+    MATCH_TIE_EPSILON = 1e-9
+
+    # 颜色数量不少于该值时使用位图去重
+    DENSE_UNIQUE_THRESHOLD = 1 << 20
+
+    # 按模板列表缓存的颜色查找表
+    _color_lut_cache = {}
+
     @staticmethod
     def calculate_scale(template: BlockTemplate, global_scale: float=1.0) -> Tuple[float, float, float]:
         """
@@ -87,10 +99,24 @@ class BlockHelper:
         Returns:
             BlockTemplate，未查找到则为None
         """
-        for block in BlockConfig.AVAILABLE_BLOCKS:
-            if block.template_id == template_id:
-                return block
-        return None
+        info = TemplateRegistry.default().get(template_id)
+        return info.template if info is not None else None
+
+    @staticmethod
+    def count_templates(template_ids: np.ndarray) -> Dict[int, int]:
+        """
+        统计每个模板的使用次数
+
+        Args:
+            template_ids: 每个方块的template_id
+
+        Returns:
+            Dict[int, int]: template_id -> 数量，按模板首次出现的顺序排列
+        """
+        unique_ids, first_index, counts = np.unique(np.asarray(template_ids, dtype=np.int64),
+                                                    return_index=True, return_counts=True)
+        order = np.argsort(first_index, kind='stable')
+        return dict(zip(unique_ids[order].tolist(), counts[order].tolist()))
 
     @staticmethod
     def hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
@@ -191,12 +217,207 @@ class BlockHelper:
         closest_template = None
         min_distance = float('inf')
 
-        for template in templates:
-            template_hsv = BlockHelper.rgb_to_hsv(template.color_tuple)
-            distance = BlockHelper.color_distance_hsv(target_hsv, template_hsv)
+        for info in TemplateRegistry.of(templates):
+            distance = BlockHelper.color_distance_hsv(target_hsv, info.hsv)
 
             if distance < min_distance:
                 min_distance = distance
-                closest_template = template
+                closest_template = templates[info.index]
+
+        return closest_template
+
+    @staticmethod
+    def rgb_array_to_hsv(rgb_array: np.ndarray) -> np.ndarray:
+        """
+        批量将RGB转换为HSV，计算步骤与rgb_to_hsv (colorsys) 逐项一致
+
+        Args:
+            rgb_array: (..., 3) RGB数组，范围0-255
+
+        Returns:
+            (..., 3) float64 HSV数组，H为0-360度，S和V为0-1
+        """
+        rgb = np.asarray(rgb_array, dtype=np.float64) / 255.0
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+        maxc = np.maximum(np.maximum(r, g), b)
+        minc = np.minimum(np.minimum(r, g), b)
+        rangec = maxc - minc
+        gray = rangec == 0
+
+        # 灰色的rangec为0，先替换为1避免除零，最后再把结果置0
+        safe_maxc = np.where(maxc == 0, 1.0, maxc)
+        safe_rangec = np.where(gray, 1.0, rangec)
+
+        s = rangec / safe_maxc
+        rc = (maxc - r) / safe_rangec
+        gc = (maxc - g) / safe_rangec
+        bc = (maxc - b) / safe_rangec
+
+        h = np.where(r == maxc, bc - gc,
+                     np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = np.mod(h / 6.0, 1.0)
+
+        h = np.where(gray, 0.0, h)
+        s = np.where(gray, 0.0, s)
+
+        return np.stack((h * 360, s, maxc), axis=-1)
+
+    @staticmethod
+    def rgb_array_to_polar(rgb_array: np.ndarray) -> np.ndarray:
+        """
+        将RGB颜色映射到 (s·cos h, s·sin h, v) 空间，
+        该空间中的欧氏距离即color_distance_hsv
+
+        Args:
+            rgb_array: (..., 3) RGB数组，范围0-255
+
+        Returns:
+            (..., 3) float64 坐标数组
+        """
+        hsv = BlockHelper.rgb_array_to_hsv(rgb_array)
+        h = np.radians(hsv[..., 0])
+        s = hsv[..., 1]
+        return np.stack((s * np.cos(h), s * np.sin(h), hsv[..., 2]), axis=-1)
+
+    @staticmethod
+    def pack_rgb(rgb_array: np.ndarray) -> np.ndarray:
+        """
+        将 (..., 3) RGB数组打包为 (...) 的24位颜色值 (r << 16) | (g << 8) | b
+        """
+        rgb_array = np.asarray(rgb_array, dtype=np.uint32)
+        return (rgb_array[..., 0] << 16) | (rgb_array[..., 1] << 8) | rgb_array[..., 2]
+
+    @staticmethod
+    def unpack_rgb(packed: np.ndarray) -> np.ndarray:
+        """
+        将24位颜色值还原为 (..., 3) uint8 RGB数组
+        """
+        packed = np.asarray(packed, dtype=np.uint32)
+        return np.stack(((packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF), axis=-1).astype(np.uint8)
+
+    @staticmethod
+    def get_palette_index(templates: List[BlockTemplate]):
+        """
+        获取模板列表对应的调色板索引，相同的模板列表只构建一次
+
+        Args:
+            templates: 可用模板列表
 
-        return closest_template
\ No newline at end of file
+        Returns:
+            PaletteIndex: 调色板索引
+        """
+        return TemplateRegistry.of(templates).palette_index
+
+    @staticmethod
+    def get_color_lut(templates: List[BlockTemplate]):
+        """
+        获取模板列表对应的颜色查找表，不存在或已过期时自动构建
+
+        Args:
+            templates: 可用模板列表
+
+        Returns:
+            ColorLut: 只读映射的颜色查找表
+        """
+        from helper.color_lut import ColorLut
+
+        key = ColorLut.palette_hash(templates)
+        lut = BlockHelper._color_lut_cache.get(key)
+        if lut is None:
+            lut = ColorLut.open(templates)
+            BlockHelper._color_lut_cache[key] = lut
+        return lut
+
+    @staticmethod
+    def match_colors(rgb_array: np.ndarray,
+                     templates: List[BlockTemplate],
+                     use_lut: bool = False) -> np.ndarray:
+        """
+        批量查找颜色最接近的模板，结果与逐个调用find_closest_template_rgb一致
+
+        Args:
+            rgb_array: (..., 3) uint8 RGB数组
+            templates: 可用模板列表
+            use_lut: 是否使用磁盘缓存的颜色查找表
+
+        Returns:
+            np.ndarray: (...) 模板在templates中的下标
+        """
+        if not templates:
+            raise ValueError("方块模板列表为空")
+
+        rgb_array = np.asarray(rgb_array)
+        if rgb_array.shape[-1] != 3:
+            raise ValueError(f"颜色数组的最后一维应为3，当前形状为 {rgb_array.shape}")
+
+        if use_lut:
+            return BlockHelper.get_color_lut(templates).match(rgb_array)
+
+        flat_rgb = rgb_array.reshape(-1, 3)
+        distances, indices = BlockHelper.get_palette_index(templates).query(flat_rgb, k=2)
+        result = indices[:, 0].copy()
+
+        # 浮点误差可能改变近似并列时的结果，这些颜色回退到逐个匹配
+        if len(templates) > 1:
+            ties = np.flatnonzero(distances[:, 1] - distances[:, 0] <= BlockHelper.MATCH_TIE_EPSILON)
+            for i in ties:
+                rgb = tuple(int(c) for c in flat_rgb[i])
+                template = BlockHelper.find_closest_template_rgb(rgb, templates)
+                result[i] = templates.index(template)
+
+        return result.reshape(rgb_array.shape[:-1])
+
+    @staticmethod
+    def match_unique_colors(rgb_array: np.ndarray,
+                            templates: List[BlockTemplate],
+                            use_lut: bool = False) -> Tuple[np.ndarray, int]:
+        """
+        先对颜色去重，只匹配不同的颜色，再把结果按原位置展开
+
+        Args:
+            rgb_array: (..., 3) uint8 RGB数组
+            templates: 可用模板列表
+            use_lut: 是否使用磁盘缓存的颜色查找表
+
+        Returns:
+            (indices, unique_count):
+                - indices: (...) 模板在templates中的下标，与match_colors结果一致
+                - unique_count: 不同颜色的数量
+        """
+        rgb_array = np.asarray(rgb_array)
+        if rgb_array.shape[-1] != 3:
+            raise ValueError(f"颜色数组的最后一维应为3，当前形状为 {rgb_array.shape}")
+
+        packed = BlockHelper.pack_rgb(rgb_array).reshape(-1)
+        unique_colors, inverse = BlockHelper.unique_packed_colors(packed)
+        unique_indices = BlockHelper.match_colors(BlockHelper.unpack_rgb(unique_colors), templates, use_lut)
+
+        return unique_indices[inverse].reshape(rgb_array.shape[:-1]), len(unique_colors)
+
+    @staticmethod
+    def unique_packed_colors(packed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        对24位颜色值去重，结果与np.unique(packed, return_inverse=True)一致
+
+        数量较大时用覆盖全部颜色的位图代替排序，耗时与数量成线性关系
+
+        Args:
+            packed: (N,) 24位颜色值
+
+        Returns:
+            (unique_colors, inverse): 升序排列的不同颜色，以及每个元素在其中的下标
+        """
+        packed = np.asarray(packed, dtype=np.uint32).reshape(-1)
+        if len(packed) < BlockHelper.DENSE_UNIQUE_THRESHOLD:
+            unique_colors, inverse = np.unique(packed, return_inverse=True)
+            return unique_colors, inverse.reshape(-1)
+
+        seen = np.zeros(1 << 24, dtype=np.bool_)
+        seen[packed] = True
+        unique_colors = np.flatnonzero(seen).astype(np.uint32)
+
+        # 只写入出现过的颜色，未使用的内存页不会被分配
+        position = np.empty(1 << 24, dtype=np.intp)
+        position[unique_colors] = np.arange(len(unique_colors))
+        return unique_colors, position[packed]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RGB颜色到模板的预编译查找表
+对固定的模板列表，为全部16777216种RGB颜色预先计算最接近的模板下标，
+以.npy文件缓存在磁盘上，多个进程可以只读映射同一份文件
+
+命令行用法：
+    python helper/color_lut.py build   预先构建当前模板列表的查找表
+    python helper/color_lut.py check   检查查找表是否存在且与当前模板列表一致
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import hashlib
+import json
+from typing import List, Optional
+
+import numpy as np
+
+from config.block_config import BlockTemplate, BlockConfig
+from helper.block_helper import BlockHelper
+
+
+class ColorLut:
+    """
+    24位RGB查找表
+
+    文件：
+    color_lut_<hash>.npy   形状 (16777216,) 的模板下标数组，下标为 (r << 16) | (g << 8) | b
+    color_lut_<hash>.json  生成该表的模板列表，用于检查查找表是否过期
+    """
+
+    COLOR_COUNT = 1 << 24
+
+    # 构建时每批计算的颜色数量
+    BUILD_CHUNK_SIZE = 1 << 20
+
+    DEFAULT_CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "cache"))
+
+    def __init__(self, table: np.ndarray, templates: List[BlockTemplate], path: str):
+        self.table = table
+        self.templates = templates
+        self.path = path
+
+    @staticmethod
+    def palette_hash(templates: List[BlockTemplate]) -> str:
+        """
+        计算模板列表的哈希，只与模板顺序、template_id和color_tuple有关
+
+        Args:
+            templates: 模板列表
+
+        Returns:
+            str: 16位十六进制哈希
+        """
+        palette = [[template.template_id, list(template.color_tuple)] for template in templates]
+        return hashlib.sha1(json.dumps(palette).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def get_path(templates: List[BlockTemplate], cache_dir: Optional[str] = None) -> str:
+        """
+        获取模板列表对应的查找表路径
+
+        Args:
+            templates: 模板列表
+            cache_dir: 缓存目录，为None时使用项目根目录下的cache
+
+        Returns:
+            str: .npy文件路径
+        """
+        if cache_dir is None:
+            cache_dir = ColorLut.DEFAULT_CACHE_DIR
+        return os.path.join(cache_dir, f"color_lut_{ColorLut.palette_hash(templates)}.npy")
+
+    @staticmethod
+    def _meta_path(path: str) -> str:
+        return os.path.splitext(path)[0] + ".json"
+
+    @staticmethod
+    def index_dtype(templates: List[BlockTemplate]) -> np.dtype:
+        """模板不超过256个时每种颜色占1字节，否则占2字节"""
+        return np.dtype(np.uint8) if len(templates) <= 256 else np.dtype(np.uint16)
+
+    @staticmethod
+    def build(templates: List[BlockTemplate], path: Optional[str] = None) -> str:
+        """
+        构建查找表并保存，表和元数据都先写入临时文件再替换，其他进程不会读到不完整的表或元数据
+
+        Args:
+            templates: 模板列表
+            path: 保存路径，为None时使用get_path的默认路径
+
+        Returns:
+            str: 查找表路径
+        """
+        if not templates:
+            raise ValueError("方块模板列表为空")
+
+        if path is None:
+            path = ColorLut.get_path(templates)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        table = np.lib.format.open_memmap(tmp_path, mode='w+',
+                                          dtype=ColorLut.index_dtype(templates),
+                                          shape=(ColorLut.COLOR_COUNT,))
+
+        for start in range(0, ColorLut.COLOR_COUNT, ColorLut.BUILD_CHUNK_SIZE):
+            rgb = BlockHelper.unpack_rgb(np.arange(start, start + ColorLut.BUILD_CHUNK_SIZE, dtype=np.uint32))
+            table[start:start + ColorLut.BUILD_CHUNK_SIZE] = BlockHelper.match_colors(rgb, templates)
+
+            done = start + ColorLut.BUILD_CHUNK_SIZE
+            print(f"\r  进度: {done}/{ColorLut.COLOR_COUNT} ({done / ColorLut.COLOR_COUNT * 100:.1f}%)", end='')
+        print()
+
+        table.flush()
+        del table
+
+        # 元数据同样先写入临时文件。is_stale先读元数据再读表，因此先替换表再替换元数据，
+        # 读到完整的元数据时表一定已经就位
+        meta = {
+            'palette_hash': ColorLut.palette_hash(templates),
+            'templates': [[template.template_id, list(template.color_tuple)] for template in templates],
+        }
+        meta_path = ColorLut._meta_path(path)
+        tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+        os.replace(tmp_meta_path, meta_path)
+
+        return path
+
+    @staticmethod
+    def is_stale(path: str, templates: List[BlockTemplate]) -> bool:
+        """
+        检查查找表是否不存在、已损坏或与模板列表不一致
+
+        Args:
+            path: 查找表路径
+            templates: 当前模板列表
+
+        Returns:
+            bool: 需要重新构建时为True
+        """
+        try:
+            with open(ColorLut._meta_path(path), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            table = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return True
+
+        return (meta.get('palette_hash') != ColorLut.palette_hash(templates)
+                or table.shape != (ColorLut.COLOR_COUNT,)
+                or table.dtype != ColorLut.index_dtype(templates))
+
+    @staticmethod
+    def open(templates: Optional[List[BlockTemplate]] = None,
+             cache_dir: Optional[str] = None,
+             build_if_missing: bool = True) -> 'ColorLut':
+        """
+        以只读内存映射方式打开查找表，多个进程打开同一文件时共享物理内存
+
+        Args:
+            templates: 模板列表，为None时使用BlockConfig.AVAILABLE_BLOCKS
+            cache_dir: 缓存目录
+            build_if_missing: 查找表不存在或已过期时是否自动构建
+
+        Returns:
+            ColorLut: 查找表
+        """
+        if templates is None:
+            templates = BlockConfig.AVAILABLE_BLOCKS
+
+        path = ColorLut.get_path(templates, cache_dir)
+        if ColorLut.is_stale(path, templates):
+            if not build_if_missing:
+                raise FileNotFoundError(f"查找表不存在或已过期: {path}")
+            print(f"构建颜色查找表: {path}")
+            ColorLut.build(templates, path)
+
+        return ColorLut(np.load(path, mmap_mode='r'), templates, path)
+
+    def match(self, rgb_array: np.ndarray) -> np.ndarray:
+        """
+        批量查找颜色最接近的模板，结果与BlockHelper.match_colors一致
+
+        Args:
+            rgb_array: (..., 3) uint8 RGB数组
+
+        Returns:
+            np.ndarray: (...) 模板在templates中的下标
+        """
+        return self.table[BlockHelper.pack_rgb(rgb_array)].astype(np.intp)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    templates = BlockConfig.AVAILABLE_BLOCKS
+    path = ColorLut.get_path(templates)
+
+    if command == 'build':
+        print(f"模板数量: {len(templates)}")
+        ColorLut.build(templates, path)
+        print(f"查找表已保存: {path}")
+    elif command == 'check':
+        if ColorLut.is_stale(path, templates):
+            print(f"查找表不存在或已过期: {path}")
+            sys.exit(1)
+        print(f"查找表是最新的: {path}")
+    else:
+        print(f"Error: 未知命令 {command}，可用命令: build, check")
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化的实体ID分配器
+在本地SQLite数据库中记录已占用的实体ID区间，分配新区间时避开已有存档和其他生成器使用的实体ID
+
+数据库结构：
+ranges  已占用的区间 [start, end)，互不重叠也不相邻，按start建立B树索引，查找为O(log n)
+gaps    int32范围内未占用的区间 (ranges的补集)，按 (size, start) 建立索引，分配时O(log n)找到足够大的空隙
+files   已扫描的文件及其大小和修改时间，文件未改变时不重复扫描
+
+命令行用法：
+    python helper/entity_id_allocator.py 数据库 scan 文件或目录...   扫描GIA/GIL文件中的实体ID
+    python helper/entity_id_allocator.py 数据库 allocate 数量 [起始值]  分配一段连续的实体ID
+    python helper/entity_id_allocator.py 数据库 check 实体ID          检查实体ID是否已被占用
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from helper.entity_id_rebaser import EntityIdRebaser
+from helper.file_helper import FileHelper
+from helper.gia_merger import GIAMerger
+from helper.wire_helper import WireHelper
+
+
+class EntityIdAllocator:
+    """
+    实体ID分配器
+
+    多个进程可以同时使用同一个数据库，分配和登记都在 BEGIN IMMEDIATE 事务中完成，
+    同一时间只有一个进程能修改区间表
+    """
+
+    INT32_MIN = -(1 << 31)
+    INT32_MAX = (1 << 31) - 1
+
+    # 等待其他进程释放数据库锁的时间 (秒)
+    LOCK_TIMEOUT = 60.0
+
+    # 扫描GIL文件时查找AssetMeta的最大嵌套深度
+    MAX_SCAN_DEPTH = 8
+
+    SCAN_EXTENSIONS = ('.gia', '.gil')
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite数据库路径，不存在时自动创建
+        """
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, timeout=self.LOCK_TIMEOUT, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ranges ("
+                           "start INTEGER PRIMARY KEY, end INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS gaps ("
+                           "start INTEGER PRIMARY KEY, size INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS gaps_size ON gaps (size, start)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                           "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)")
+        self._init_gaps()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self) -> 'EntityIdAllocator':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _init_gaps(self):
+        """空隙表为空时 (新数据库或旧版本创建的数据库) 由区间表重建"""
+        if self._conn.execute("SELECT 1 FROM gaps LIMIT 1").fetchone() is not None:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 等待锁期间其他进程可能已经重建
+            if self._conn.execute("SELECT 1 FROM gaps LIMIT 1").fetchone() is None:
+                ranges = np.array(self._conn.execute("SELECT start, end FROM ranges ORDER BY start").fetchall(),
+                                  dtype=np.int64).reshape(-1, 2)
+                self._insert_gaps(self.INT32_MIN, ranges[:, 0], ranges[:, 1], self.INT32_MAX + 1)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _insert_gaps(self, low: int, starts: np.ndarray, ends: np.ndarray, high: int):
+        """登记 [low, high) 中除已占用区间 [starts, ends) 以外的空隙，超出int32范围的部分不登记"""
+        gap_starts = np.maximum(np.concatenate(([low], ends)), self.INT32_MIN)
+        gap_ends = np.minimum(np.concatenate((starts, [high])), self.INT32_MAX + 1)
+        keep = gap_ends > gap_starts
+        self._conn.executemany("INSERT INTO gaps (start, size) VALUES (?, ?)",
+                               zip(gap_starts[keep].tolist(), (gap_ends - gap_starts)[keep].tolist()))
+
+    def _find_range(self, entity_id: int) -> Optional[Tuple[int, int]]:
+        """查找包含entity_id的区间"""
+        row = self._conn.execute("SELECT start, end FROM ranges WHERE start <= ? ORDER BY start DESC LIMIT 1",
+                                 (entity_id,)).fetchone()
+        if row is None or row[1] <= entity_id:
+            return None
+        return row
+
+    @staticmethod
+    def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        合并重叠或相邻的区间
+
+        Args:
+            starts: 区间起始值
+            ends: 区间结束值 (不含)
+
+        Returns:
+            (starts, ends): 按起始值排序、互不重叠也不相邻的区间
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], ends[order]
+        if len(starts) == 0:
+            return starts, ends
+
+        running_end = np.maximum.accumulate(ends)
+        group_start = np.concatenate(([0], np.flatnonzero(starts[1:] > running_end[:-1]) + 1))
+        return starts[group_start], np.maximum.reduceat(ends, group_start)
+
+    def _reserve(self, starts: np.ndarray, ends: np.ndarray):
+        """
+        登记多个区间 [start, end)，与已有的重叠或相邻区间合并，需要在事务中调用
+
+        只读取和改写新区间覆盖范围内的已有区间
+        """
+        low, high = int(starts.min()), int(ends.max())
+        previous = self._conn.execute("SELECT start, end FROM ranges WHERE start < ? ORDER BY start DESC LIMIT 1",
+                                      (low,)).fetchone()
+        if previous is not None and previous[1] >= low:
+            low = previous[0]
+
+        existing = np.array(self._conn.execute("SELECT start, end FROM ranges WHERE start >= ? AND start <= ?",
+                                               (low, high)).fetchall(), dtype=np.int64).reshape(-1, 2)
+        merged_starts, merged_ends = self.merge_intervals(np.concatenate((starts, existing[:, 0])),
+                                                          np.concatenate((ends, existing[:, 1])))
+
+        self._conn.execute("DELETE FROM ranges WHERE start >= ? AND start <= ?", (low, high))
+        self._conn.executemany("INSERT INTO ranges (start, end) VALUES (?, ?)",
+                               zip(merged_starts.tolist(), merged_ends.tolist()))
+
+        # 重建前后两个已有区间之间的空隙
+        low, high = int(merged_starts[0]), int(merged_ends[-1])
+        previous = self._conn.execute("SELECT end FROM ranges WHERE start < ? ORDER BY start DESC LIMIT 1",
+                                      (low,)).fetchone()
+        following = self._conn.execute("SELECT start FROM ranges WHERE start > ? ORDER BY start LIMIT 1",
+                                       (high,)).fetchone()
+        gaps_low = self.INT32_MIN if previous is None else previous[0]
+        gaps_high = self.INT32_MAX + 1 if following is None else following[0]
+        self._conn.execute("DELETE FROM gaps WHERE start >= ? AND start < ?",
+                           (min(gaps_low, low), max(gaps_high, high)))
+        self._insert_gaps(gaps_low, merged_starts, merged_ends, gaps_high)
+
+    def _reserve_intervals(self, starts: np.ndarray, ends: np.ndarray):
+        """在一个事务中登记多个区间"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._reserve(starts, ends)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def reserve(self, start: int, count: int):
+        """
+        登记已被占用的实体ID [start, start + count)
+
+        Args:
+            start: 起始实体ID
+            count: 数量
+        """
+        if count <= 0:
+            return
+        self._reserve_intervals(np.array([start]), np.array([start + count]))
+
+    def reserve_ids(self, entity_ids: np.ndarray):
+        """
+        登记一组已被占用的实体ID，连续的实体ID合并为一个区间
+
+        Args:
+            entity_ids: 实体ID数组
+        """
+        starts, ends = self.ids_to_intervals(entity_ids)
+        if len(starts) > 0:
+            self._reserve_intervals(starts, ends)
+
+    def is_reserved(self, entity_id: int) -> bool:
+        """实体ID是否已被占用"""
+        return self._find_range(entity_id) is not None
+
+    def allocate(self, count: int, minimum: int = 1) -> int:
+        """
+        分配count个连续且未被占用的实体ID，并登记为已占用
+
+        minimum未被占用且之后的空隙足够大时从minimum开始分配，
+        否则在minimum之后足够大的空隙中选择最小的一个 (最佳适配)，保留大的空隙，
+        通过空隙表的 (size, start) 索引查找，不逐个检查已占用的区间
+
+        Args:
+            count: 数量
+            minimum: 实体ID的最小值
+
+        Returns:
+            int: 起始实体ID
+        """
+        if count <= 0:
+            raise ValueError(f"分配数量必须大于0: {count}")
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            containing = self._conn.execute("SELECT start, size FROM gaps WHERE start <= ? "
+                                            "ORDER BY start DESC LIMIT 1", (minimum,)).fetchone()
+            if containing is not None and containing[0] + containing[1] - minimum >= count:
+                candidate = minimum
+            else:
+                row = self._conn.execute("SELECT start FROM gaps WHERE size >= ? AND start >= ? "
+                                         "ORDER BY size, start LIMIT 1", (count, minimum)).fetchone()
+                if row is None:
+                    raise ValueError(f"没有足够的实体ID可以分配: {count}")
+                candidate = row[0]
+
+            self._reserve(np.array([candidate]), np.array([candidate + count]))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return candidate
+
+    def iter_ranges(self) -> Iterable[Tuple[int, int]]:
+        """按顺序列出所有已占用的区间 [start, end)"""
+        return self._conn.execute("SELECT start, end FROM ranges ORDER BY start")
+
+    @staticmethod
+    def ids_to_intervals(entity_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        把实体ID压缩为连续区间
+
+        Args:
+            entity_ids: 实体ID数组
+
+        Returns:
+            (starts, ends): 每个区间 [start, end) 的起止值
+        """
+        ids = np.unique(np.asarray(entity_ids, dtype=np.int64))
+        if len(ids) == 0:
+            return ids, ids
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        starts = ids[np.concatenate(([0], breaks))]
+        ends = ids[np.concatenate((breaks - 1, [len(ids) - 1]))] + 1
+        return starts, ends
+
+    @staticmethod
+    def _scan_asset_metas(buffer, start: int, end: int, depth: int, entity_ids: List[int]) -> bool:
+        """
+        在结构未知的消息中查找AssetMeta (只有字段2、3、4，且meta_type为ENTITY)
+
+        Returns:
+            bool: [start, end) 是否能按消息解析
+        """
+        try:
+            fields = list(WireHelper.iter_fields(buffer, start, end))
+        except ValueError:
+            return False
+
+        varints = {}
+        for number, wire_type, _, value_start, _ in fields:
+            if wire_type == WireHelper.VARINT:
+                varints[number] = WireHelper.decode_varint(buffer, value_start)[0]
+        if (fields and varints.get(3) == EntityIdRebaser.META_TYPE_ENTITY and 4 in varints
+                and all(number in (2, 3, 4) and wire_type == WireHelper.VARINT
+                        for number, wire_type, _, _, _ in fields)):
+            entity_ids.append(WireHelper.to_int32(varints[4]))
+            return True
+
+        if depth > 0:
+            for _, wire_type, _, value_start, value_end in fields:
+                if wire_type == WireHelper.LENGTH_DELIMITED and value_end > value_start:
+                    EntityIdAllocator._scan_asset_metas(buffer, value_start, value_end, depth - 1, entity_ids)
+        return True
+
+    @staticmethod
+    def scan_entity_ids(filename: str) -> np.ndarray:
+        """
+        读取文件中的实体ID
+
+        GIA文件按GIACollection读取每个Asset的meta.asset_id；
+        GIL文件的结构未知，在嵌套消息中查找AssetMeta
+
+        Args:
+            filename: GIA/GIL文件路径
+
+        Returns:
+            np.ndarray: 实体ID数组
+        """
+        proto_data, header = FileHelper.load_mapped(filename)
+        try:
+            if not header.valid:
+                raise ValueError(f"文件格式不正确 {filename}")
+            if filename.lower().endswith('.gia'):
+                return GIAMerger.scan_entity_ids(proto_data)
+
+            entity_ids: List[int] = []
+            EntityIdAllocator._scan_asset_metas(proto_data, 0, len(proto_data), EntityIdAllocator.MAX_SCAN_DEPTH,
+                                                entity_ids)
+            return np.array(entity_ids, dtype=np.int64)
+        finally:
+            proto_data.release()
+
+    def scan_file(self, filename: str, force: bool = False) -> int:
+        """
+        扫描文件并登记其中的实体ID，文件大小和修改时间未改变时跳过
+
+        Args:
+            filename: GIA/GIL文件路径
+            force: 是否忽略扫描记录重新扫描
+
+        Returns:
+            int: 登记的实体ID数量，跳过时为0
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        if not force:
+            row = self._conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+            if row == (stat.st_size, stat.st_mtime_ns):
+                return 0
+
+        entity_ids = self.scan_entity_ids(path)
+        starts, ends = self.ids_to_intervals(entity_ids)
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if len(starts) > 0:
+                self._reserve(starts, ends)
+            self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                               (path, stat.st_size, stat.st_mtime_ns))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return len(entity_ids)
+
+    @staticmethod
+    def _is_excluded(path: str, excluded: List[str]) -> bool:
+        """path是否为excluded中的文件，或位于excluded中的目录下 (excluded为normcase后的绝对路径)"""
+        path = os.path.normcase(os.path.abspath(path))
+        return any(path == item or path.startswith(item.rstrip(os.sep) + os.sep) for item in excluded)
+
+    def scan_paths(self, paths: Iterable[str], exclude: Iterable[str] = ()) -> int:
+        """
+        扫描文件或目录 (递归查找.gia/.gil文件)，无法读取的文件打印错误后跳过
+
+        Args:
+            paths: 文件或目录路径
+            exclude: 不扫描的文件或目录，如本次将被覆盖的输出文件
+
+        Returns:
+            int: 登记的实体ID数量
+        """
+        excluded = [os.path.normcase(os.path.abspath(path)) for path in exclude]
+        filenames = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    filenames.extend(os.path.join(root, name) for name in sorted(names)
+                                     if name.lower().endswith(self.SCAN_EXTENSIONS))
+            elif os.path.exists(path):
+                filenames.append(path)
+
+        total = 0
+        for filename in filenames:
+            if self._is_excluded(filename, excluded):
+                continue
+            try:
+                total += self.scan_file(filename)
+            except (OSError, ValueError) as e:
+                print(f"Error: 扫描文件失败 {filename}: {e}")
+        return total
+
+    @staticmethod
+    def allocate_for_run(db_path: str, scan_paths: Iterable[str], count: int, minimum: int,
+                         exclude: Iterable[str] = (), reserved_ids: Optional[np.ndarray] = None) -> int:
+        """
+        生成器使用: 先登记scan_paths中已有文件的实体ID，再分配count个连续的实体ID
+
+        Args:
+            db_path: 数据库路径
+            scan_paths: 需要避开的GIA/GIL文件或目录
+            count: 数量，为0时不分配，直接返回minimum
+            minimum: 实体ID的最小值
+            exclude: 不扫描的文件或目录，如本次将被覆盖的输出文件
+            reserved_ids: 分配前登记为已占用的实体ID，如增量生成时沿用的实体ID
+                (被排除的输出文件可能不是通过数据库分配的，其实体ID需在此登记)
+
+        Returns:
+            int: 起始实体ID
+        """
+        if count <= 0:
+            return minimum
+        with EntityIdAllocator(db_path) as allocator:
+            allocator.scan_paths(scan_paths, exclude)
+            if reserved_ids is not None:
+                allocator.reserve_ids(reserved_ids)
+            return allocator.allocate(count, minimum)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+
+    db_path, command, args = sys.argv[1], sys.argv[2], sys.argv[3:]
+    with EntityIdAllocator(db_path) as allocator:
+        if command == 'scan':
+            count = allocator.scan_paths(args)
+            print(f"登记实体ID: {count} 个")
+        elif command == 'allocate' and args:
+            minimum = int(args[1]) if len(args) > 1 else 1
+            start = allocator.allocate(int(args[0]), minimum)
+            print(f"实体ID范围: {start} - {start + int(args[0]) - 1}")
+        elif command == 'check' and args:
+            entity_id = int(args[0])
+            print(f"{entity_id}: {'已占用' if allocator.is_reserved(entity_id) else '未占用'}")
+        else:
+            print(f"Error: 未知命令 {command}，可用命令: scan, allocate, check")
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
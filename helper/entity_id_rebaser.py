@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实体ID重排工具
+在线格式上按偏移量或映射表改写GIA中的实体ID，不解码完整的消息树，
+只重新编码被改写的字段以及包含它们的消息的长度前缀
+
+改写的字段：
+Asset
+  1  meta: AssetMeta { 4: asset_id }                    (meta_type为ENTITY时)
+  2  dependent_assets: AssetMeta { 4: asset_id }        (meta_type为ENTITY时)
+  3  name                                              (等于 Entity_{旧实体ID} 时)
+  12 entity_data: Entity { 1: EntityData { 1: entity_id } }
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from typing import Callable, Dict, Iterator, List, Optional
+
+from assembler.block_wire_encoder import BlockWireEncoder
+from helper.file_helper import FileHelper
+from helper.wire_helper import WireHelper
+
+
+class EntityIdRebaser:
+    """
+    实体ID重排器
+    """
+
+    # AssetMeta.meta_type = ENTITY
+    META_TYPE_ENTITY = 2
+
+    def __init__(self, offset: int = 0, remap: Optional[Dict[int, int]] = None):
+        """
+        Args:
+            offset: 所有实体ID加上的偏移量
+            remap: 旧实体ID -> 新实体ID，指定时忽略offset，不在表中的实体ID保持不变
+        """
+        self.offset = offset
+        self.remap = remap
+
+        # 字段号 -> 改写函数
+        self._asset_handlers = {1: self._rewrite_meta, 2: self._rewrite_meta, 3: self._rewrite_name,
+                                12: self._rewrite_entity}
+        self._entity_handlers = {1: self._rewrite_entity_data}
+        self._entity_data_handlers = {1: self._rewrite_id}
+
+        # 当前Asset的实体ID (meta.asset_id)，用于改写默认名称
+        self._asset_id: Optional[int] = None
+
+    def map_id(self, entity_id: int) -> int:
+        """计算新的实体ID，0表示未设置，保持不变"""
+        if entity_id == 0:
+            return 0
+        if self.remap is not None:
+            new_id = self.remap.get(entity_id, entity_id)
+        else:
+            new_id = entity_id + self.offset
+        return BlockWireEncoder._check_int32(new_id, "entity_id")
+
+    @staticmethod
+    def read_asset_id(buffer, start: int, end: int) -> Optional[int]:
+        """
+        读取Asset的实体ID (meta.asset_id)，meta_type不是ENTITY或未设置实体ID时为None
+
+        Args:
+            buffer: 字节数据
+            start: Asset消息的起始位置
+            end: Asset消息的结束位置
+        """
+        meta = WireHelper.find_field(buffer, start, end, 1)
+        if meta is None or meta[0] != WireHelper.LENGTH_DELIMITED:
+            return None
+        _, _, meta_start, meta_end = meta
+        if WireHelper.read_varint_path(buffer, meta_start, meta_end, (3,)) != EntityIdRebaser.META_TYPE_ENTITY:
+            return None
+        asset_id = WireHelper.read_varint_path(buffer, meta_start, meta_end, (4,))
+        return None if asset_id is None else WireHelper.to_int32(asset_id)
+
+    def _rewrite_message(self, buffer, start: int, end: int,
+                         handlers: Dict[int, Callable[..., Optional[bytes]]]) -> Optional[bytes]:
+        """
+        改写消息中的部分字段
+
+        handler(buffer, field_number, wire_type, value_start, value_end) 返回新的字段值
+        (长度前缀字段不含长度前缀)，返回None表示不改变，返回b''且为varint字段时删除该字段 (proto3中值为0)
+
+        Returns:
+            Optional[bytes]: 新的消息，没有字段被改写时为None
+        """
+        chunks: List[bytes] = []
+        copied = start
+        for number, wire_type, field_start, value_start, value_end in WireHelper.iter_fields(buffer, start, end):
+            handler = handlers.get(number)
+            if handler is None:
+                continue
+            value = handler(buffer, number, wire_type, value_start, value_end)
+            if value is None:
+                continue
+
+            chunks.append(buffer[copied:field_start])
+            copied = value_end
+            tag = bytes(buffer[field_start:WireHelper.decode_varint(buffer, field_start)[1]])
+            if wire_type == WireHelper.LENGTH_DELIMITED:
+                chunks.append(BlockWireEncoder._length_delimited(tag, value))
+            elif value:
+                chunks.append(tag + value)
+
+        if not chunks:
+            return None
+        chunks.append(buffer[copied:end])
+        return b''.join(chunks)
+
+    def _rewrite_id(self, buffer, number: int, wire_type: int, value_start: int, value_end: int) -> Optional[bytes]:
+        """改写int32实体ID字段"""
+        if wire_type != WireHelper.VARINT:
+            return None
+        old_id = WireHelper.to_int32(WireHelper.decode_varint(buffer, value_start)[0])
+        new_id = self.map_id(old_id)
+        if new_id == old_id:
+            return None
+        return b'' if new_id == 0 else BlockWireEncoder.encode_varint(new_id)
+
+    def _rewrite_meta(self, buffer, number: int, wire_type: int, start: int, end: int) -> Optional[bytes]:
+        """改写AssetMeta.asset_id，只处理meta_type为ENTITY的AssetMeta"""
+        if wire_type != WireHelper.LENGTH_DELIMITED:
+            return None
+        meta_type = 0
+        id_field = None
+        for field_number, field_wire_type, field_start, value_start, value_end in \
+                WireHelper.iter_fields(buffer, start, end):
+            if field_wire_type != WireHelper.VARINT:
+                continue
+            if field_number == 3:
+                meta_type = WireHelper.decode_varint(buffer, value_start)[0]
+            elif field_number == 4:
+                id_field = (field_start, value_start, value_end)
+        if meta_type != self.META_TYPE_ENTITY or id_field is None:
+            return None
+
+        field_start, value_start, value_end = id_field
+        old_id = WireHelper.to_int32(WireHelper.decode_varint(buffer, value_start)[0])
+        if number == 1:
+            self._asset_id = old_id
+        new_id = self.map_id(old_id)
+        if new_id == old_id:
+            return None
+        new_field = b'\x20' + BlockWireEncoder.encode_varint(new_id) if new_id != 0 else b''
+        return b''.join((buffer[start:field_start], new_field, buffer[value_end:end]))
+
+    def _rewrite_name(self, buffer, number: int, wire_type: int, start: int, end: int) -> Optional[bytes]:
+        """未命名方块的名称为 Entity_{实体ID}，随实体ID一起改写"""
+        if self._asset_id is None or wire_type != WireHelper.LENGTH_DELIMITED:
+            return None
+        new_id = self.map_id(self._asset_id)
+        if new_id == self._asset_id or buffer[start:end] != f"Entity_{self._asset_id}".encode('utf-8'):
+            return None
+        return f"Entity_{new_id}".encode('utf-8')
+
+    def _rewrite_entity(self, buffer, number: int, wire_type: int, start: int, end: int) -> Optional[bytes]:
+        """改写Asset.entity_data (Entity)"""
+        if wire_type != WireHelper.LENGTH_DELIMITED:
+            return None
+        return self._rewrite_message(buffer, start, end, self._entity_handlers)
+
+    def _rewrite_entity_data(self, buffer, number: int, wire_type: int, start: int, end: int) -> Optional[bytes]:
+        """改写Entity.data (EntityData)"""
+        if wire_type != WireHelper.LENGTH_DELIMITED:
+            return None
+        return self._rewrite_message(buffer, start, end, self._entity_data_handlers)
+
+    def rebase_asset(self, buffer, start: int, end: int) -> Optional[bytes]:
+        """
+        改写一个Asset中的实体ID
+
+        Args:
+            buffer: 字节数据
+            start: Asset消息的起始位置
+            end: Asset消息的结束位置
+
+        Returns:
+            Optional[bytes]: 新的Asset，实体ID没有变化时为None
+        """
+        self._asset_id = None
+        return self._rewrite_message(buffer, start, end, self._asset_handlers)
+
+    def iter_records(self, proto_data) -> Iterator[bytes]:
+        """
+        逐条改写GIACollection中的Asset记录
+
+        Args:
+            proto_data: GIACollection的protobuf数据
+
+        Returns:
+            Iterator[bytes]: 每条记录 (含字段头)，未改变的记录为原数据的切片
+        """
+        for record_start, value_start, value_end in WireHelper.iter_record_spans(proto_data, 1):
+            asset = self.rebase_asset(proto_data, value_start, value_end)
+            if asset is None:
+                yield proto_data[record_start:value_end]
+            else:
+                yield BlockWireEncoder.encode_record(asset)
+
+    def rebase(self, proto_data) -> bytes:
+        """
+        改写protobuf数据中的实体ID
+
+        Args:
+            proto_data: GIACollection的protobuf数据
+
+        Returns:
+            bytes: 新的protobuf数据
+        """
+        return b''.join(self.iter_records(proto_data))
+
+    def rebase_file(self, filename: str, output: str) -> bool:
+        """
+        改写GIA文件中的实体ID，逐条写入输出文件
+
+        输入文件只在写入记录期间映射，且只输出bytes、不保留映射的切片，
+        替换输出文件前映射已关闭，因此输出文件可以与输入文件相同 (Windows无法替换仍被映射的文件)
+
+        Args:
+            filename: 输入文件路径
+            output: 输出文件路径，可以与输入文件相同
+
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            proto_data, header = FileHelper.load_mapped(filename)
+        except OSError as e:
+            print(f"Error: 读取文件失败 {e}")
+            return False
+        if not header.valid:
+            proto_data.release()
+            print(f"Error: 文件格式不正确 {filename}")
+            return False
+
+        def iter_chunks():
+            try:
+                for record in self.iter_records(proto_data):
+                    yield bytes(record)
+            finally:
+                proto_data.release()
+
+        chunks = iter_chunks()
+        try:
+            return FileHelper.save_stream(chunks, output)
+        finally:
+            # 写入失败时生成器可能没有执行完
+            chunks.close()
+
+
+def main():
+    if len(sys.argv) != 4:
+        print("用法: python helper/entity_id_rebaser.py 输入文件 输出文件 偏移量")
+        sys.exit(2)
+
+    success = EntityIdRebaser(offset=int(sys.argv[3])).rebase_file(sys.argv[1], sys.argv[2])
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,13 @@
 自动处理存档文件的header和footer
 """
 
+import mmap
+import os
 import struct
-from typing import Union
+import tempfile
+from typing import Iterable, List, Sequence, Tuple
+
+from model.gia_header import GIAHeader
 
 
 class FileHelper:
@@ -29,46 +34,157 @@ class FileHelper:
 
     FOOTER = b'\x00\x00\x06\x79'
 
+    HEADER_SIZE = 20
+
+    # 流式写入时的文件缓冲区大小
+    STREAM_BUFFER_SIZE = 1 << 20
+
+    @staticmethod
+    def build_header(proto_size: int) -> bytes:
+        """
+        构建20字节的header
+
+        Args:
+            proto_size: protobuf数据大小
+
+        Returns:
+            bytes: header
+        """
+        total_file_size = FileHelper.HEADER_SIZE + proto_size + len(FileHelper.FOOTER)
+
+        # 计算header中的两个大小字段
+        size_field_1 = total_file_size - 4
+        size_field_2 = total_file_size - 24
+
+        return (
+            struct.pack('>I', size_field_1) +
+            FileHelper.HEADER_FIELD_1 +
+            FileHelper.HEADER_FIELD_2 +
+            FileHelper.HEADER_FIELD_3 +
+            struct.pack('>I', size_field_2)
+        )
+
+    @staticmethod
+    def _create_temp_file(filename: str) -> tuple[int, str]:
+        """
+        在目标文件所在目录创建临时文件，写入完成后用os.replace原子替换目标文件，
+        读取方不会看到写了一半的文件
+
+        Returns:
+            tuple: (fd, temp_path)
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp', dir=directory)
+
+        # mkstemp创建的文件权限为0600，改为与open()相同的默认权限
+        if hasattr(os, 'fchmod'):
+            umask = os.umask(0)
+            os.umask(umask)
+            os.fchmod(fd, 0o666 & ~umask)
+        return fd, temp_path
+
+    @staticmethod
+    def _write_vectored(fd: int, buffers: List[memoryview]):
+        """
+        用一次writev写入多个缓冲区，不拼接数据；只写入了一部分时从中断处继续
+        """
+        if not hasattr(os, 'writev'):
+            with os.fdopen(os.dup(fd), 'wb', buffering=0) as f:
+                f.writelines(buffers)
+            return
+
+        buffers = [buffer for buffer in buffers if len(buffer) > 0]
+        while buffers:
+            written = os.writev(fd, buffers)
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and written > 0:
+                buffers[0] = buffers[0][written:]
+
     @staticmethod
-    def save(proto_data: Union[bytes, bytearray], filename: str) -> bool:
+    def save(proto_data, filename: str) -> bool:
         """
         保存protobuf数据为GIA文件
 
+        header、数据和footer通过一次分散写入 (writev) 写到临时文件，不复制数据，
+        写入完成后原子替换目标文件
+
         Args:
-            proto_data: protobuf编码后的字节数组
+            proto_data: protobuf编码后的数据，支持bytes、bytearray、memoryview、mmap等任意缓冲区对象
             filename: 保存的文件路径
 
         Returns:
             bool: 保存是否成功
         """
+        temp_path = None
         try:
-            # 确保proto_data是bytes类型
-            if isinstance(proto_data, bytearray):
-                proto_data = bytes(proto_data)
-            elif not isinstance(proto_data, bytes):
-                raise TypeError(f"Error: proto_data必须是bytes或bytearray类型，当前是 {type(proto_data)}")
+            try:
+                payload = memoryview(proto_data).cast('B')
+            except TypeError:
+                raise TypeError(f"proto_data必须支持缓冲区协议，当前是 {type(proto_data)}")
 
             # 计算文件大小
-            proto_size = len(proto_data)
-            total_file_size = 20 + proto_size + 4
-
-            # 计算header中的两个大小字段
-            size_field_1 = total_file_size - 4
-            size_field_2 = total_file_size - 24
+            proto_size = payload.nbytes
+            total_file_size = FileHelper.HEADER_SIZE + proto_size + len(FileHelper.FOOTER)
 
             # 构建header
-            header = (
-                struct.pack('>I', size_field_1) +
-                FileHelper.HEADER_FIELD_1 +
-                FileHelper.HEADER_FIELD_2 +
-                FileHelper.HEADER_FIELD_3 +
-                struct.pack('>I', size_field_2)
-            )
+            header = FileHelper.build_header(proto_size)
 
-            file_data = header + proto_data + FileHelper.FOOTER
+            fd, temp_path = FileHelper._create_temp_file(filename)
+            try:
+                FileHelper._write_vectored(fd, [memoryview(header), payload, memoryview(FileHelper.FOOTER)])
+            finally:
+                os.close(fd)
+            os.replace(temp_path, filename)
+            temp_path = None
+
+            # 打印信息
+            print(f"文件已保存至 {filename}")
+            print(f"文件大小: {total_file_size} 字节")
+            print(f"Protobuf大小: {proto_size} 字节")
+
+            return True
+
+        except Exception as e:
+            print(f"Error: 保存GIA文件失败 {e}")
+            return False
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def save_stream(chunks: Iterable[bytes], filename: str) -> bool:
+        """
+        流式保存protobuf数据为GIA文件，内存占用与数据总大小无关
+
+        先写入占位header，逐块写入数据和footer后，再回到文件开头写入两个大小字段，
+        全部写入临时文件后原子替换目标文件
+
+        Args:
+            chunks: 依次写入的protobuf数据块，拼接后为完整的protobuf数据
+            filename: 保存的文件路径
+
+        Returns:
+            bool: 保存是否成功
+        """
+        temp_path = None
+        try:
+            proto_size = 0
+            fd, temp_path = FileHelper._create_temp_file(filename)
+            with os.fdopen(fd, 'wb', buffering=FileHelper.STREAM_BUFFER_SIZE) as f:
+                f.write(bytes(FileHelper.HEADER_SIZE))
+                for chunk in chunks:
+                    f.write(chunk)
+                    proto_size += len(chunk)
+                f.write(FileHelper.FOOTER)
 
-            with open(filename, 'wb') as f:
-                f.write(file_data)
+                f.seek(0)
+                f.write(FileHelper.build_header(proto_size))
+            os.replace(temp_path, filename)
+            temp_path = None
+
+            total_file_size = FileHelper.HEADER_SIZE + proto_size + len(FileHelper.FOOTER)
 
             # 打印信息
             print(f"文件已保存至 {filename}")
@@ -80,6 +196,86 @@ class FileHelper:
         except Exception as e:
             print(f"Error: 保存GIA文件失败 {e}")
             return False
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int):
+        """
+        把源文件从offset开始的count字节复制到目标文件的当前位置
+
+        优先使用copy_file_range (同一文件系统上可以不经过用户态，甚至共享数据块)，
+        其次sendfile，都不可用时按块读写
+        """
+        for copy in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, copy):
+                continue
+            try:
+                while count > 0:
+                    if copy == 'copy_file_range':
+                        copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+                    else:
+                        copied = os.sendfile(dst_fd, src_fd, offset, count)
+                    if copied == 0:
+                        raise EOFError("源文件在复制过程中被截断")
+                    offset += copied
+                    count -= copied
+                return
+            except OSError:
+                # 跨文件系统、不支持的文件类型等，换下一种方式继续复制剩余部分
+                continue
+
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        while count > 0:
+            chunk = os.read(src_fd, min(count, FileHelper.STREAM_BUFFER_SIZE))
+            if not chunk:
+                raise EOFError("源文件在复制过程中被截断")
+            FileHelper._write_vectored(dst_fd, [memoryview(chunk)])
+            count -= len(chunk)
+
+    @staticmethod
+    def save_file_ranges(ranges: Sequence[Tuple[str, int, int]], filename: str) -> bool:
+        """
+        把多个文件中的字节范围依次拼接为protobuf数据保存为GIA文件，数据不经过Python对象
+
+        Args:
+            ranges: [(源文件路径, 起始位置, 字节数), ...]
+            filename: 保存的文件路径，可以是源文件之一
+
+        Returns:
+            bool: 保存是否成功
+        """
+        temp_path = None
+        try:
+            proto_size = sum(count for _, _, count in ranges)
+            total_file_size = FileHelper.HEADER_SIZE + proto_size + len(FileHelper.FOOTER)
+
+            fd, temp_path = FileHelper._create_temp_file(filename)
+            try:
+                FileHelper._write_vectored(fd, [memoryview(FileHelper.build_header(proto_size))])
+                for source, offset, count in ranges:
+                    with open(source, 'rb') as src:
+                        FileHelper._copy_range(src.fileno(), fd, offset, count)
+                FileHelper._write_vectored(fd, [memoryview(FileHelper.FOOTER)])
+            finally:
+                os.close(fd)
+            os.replace(temp_path, filename)
+            temp_path = None
+
+            # 打印信息
+            print(f"文件已保存至 {filename}")
+            print(f"文件大小: {total_file_size} 字节")
+            print(f"Protobuf大小: {proto_size} 字节")
+
+            return True
+
+        except Exception as e:
+            print(f"Error: 保存GIA文件失败 {e}")
+            return False
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
 
     @staticmethod
     def load(filename: str) -> tuple[bytes | None, bool]:
@@ -129,3 +325,64 @@ class FileHelper:
         except Exception as e:
             print(f"Error: 读取文件失败 {e}")
             return None, False
+
+    @staticmethod
+    def parse_header(file_data) -> GIAHeader:
+        """
+        解析并校验header和footer，不打印信息
+
+        Args:
+            file_data: 完整的文件数据 (bytes、mmap等缓冲区对象)
+
+        Returns:
+            GIAHeader: 文件头信息，文件不足24字节时各字段为空，valid为False
+        """
+        file_size = len(file_data)
+        if file_size < FileHelper.HEADER_SIZE + len(FileHelper.FOOTER):
+            return GIAHeader(file_size=file_size)
+
+        size_field_1, size_field_2 = struct.unpack('>I12xI', file_data[:FileHelper.HEADER_SIZE])
+        header = GIAHeader(
+            file_size=file_size,
+            size_field_1=size_field_1,
+            size_field_2=size_field_2,
+            field_1=bytes(file_data[4:8]),
+            field_2=bytes(file_data[8:12]),
+            field_3=bytes(file_data[12:16]),
+            footer=bytes(file_data[file_size - 4:file_size])
+        )
+        header.valid = (size_field_1 == file_size - 4
+                        and size_field_2 == file_size - 24
+                        and header.field_1 == FileHelper.HEADER_FIELD_1
+                        and header.field_2 == FileHelper.HEADER_FIELD_2
+                        and header.field_3 == FileHelper.HEADER_FIELD_3
+                        and header.footer == FileHelper.FOOTER)
+        return header
+
+    @staticmethod
+    def load_mapped(filename: str) -> tuple[memoryview, GIAHeader]:
+        """
+        以内存映射方式读取GIA文件，不复制数据，只有被访问的部分才会读入内存
+
+        返回的memoryview引用映射，映射在memoryview (及其切片) 被释放后关闭。
+        文件不存在或无法读取时抛出OSError
+
+        Args:
+            filename: GIA文件路径
+
+        Returns:
+            tuple: (proto_data, header)
+                - proto_data: protobuf数据的只读memoryview，文件不足24字节时为空
+                - header: 文件头信息，header.valid表示文件格式是否正确
+        """
+        with open(filename, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                return memoryview(b''), GIAHeader(file_size=0)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = FileHelper.parse_header(mapped)
+        if file_size < FileHelper.HEADER_SIZE + len(FileHelper.FOOTER):
+            mapped.close()
+            return memoryview(b''), header
+        return memoryview(mapped)[FileHelper.HEADER_SIZE:file_size - len(FileHelper.FOOTER)], header
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GIA文件合并工具
+GIACollection的每个Asset都是字段1的长度前缀记录，多个文件的protobuf数据直接拼接即为合并结果，
+不需要解析和重新序列化。合并前只扫描每条记录的实体ID，检查是否重复
+
+命令行用法：
+    python helper/gia_merger.py 输出文件 输入文件1 输入文件2 ... [--allow-duplicates] [--rebase]
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from helper.entity_id_rebaser import EntityIdRebaser
+from helper.file_helper import FileHelper
+from helper.wire_helper import WireHelper
+
+
+class GIAMerger:
+    """
+    GIA文件合并器
+    """
+
+    @staticmethod
+    def scan_entity_ids(proto_data) -> np.ndarray:
+        """
+        按顺序读取每个Asset的实体ID，不解码消息
+
+        Args:
+            proto_data: GIACollection的protobuf数据
+
+        Returns:
+            np.ndarray: (N,) int64 实体ID，不是实体或未设置实体ID的Asset不计入
+        """
+        entity_ids = []
+        for _, value_start, value_end in WireHelper.iter_record_spans(proto_data, 1):
+            entity_id = EntityIdRebaser.read_asset_id(proto_data, value_start, value_end)
+            if entity_id is not None:
+                entity_ids.append(entity_id)
+        return np.array(entity_ids, dtype=np.int64)
+
+    @staticmethod
+    def compute_offsets(ids_per_file: List[np.ndarray]) -> List[int]:
+        """
+        为每个文件计算实体ID偏移量，与前面文件的实体ID冲突的文件整体移到已用的最大实体ID之后
+
+        Args:
+            ids_per_file: 每个文件的实体ID数组
+
+        Returns:
+            List[int]: 每个文件的偏移量，不冲突的文件为0
+        """
+        offsets = []
+        used = np.zeros(0, dtype=np.int64)
+        next_free = None
+        for ids in ids_per_file:
+            offset = 0
+            if len(ids) > 0:
+                if len(used) > 0 and np.isin(ids, used).any():
+                    offset = next_free - int(ids.min())
+                shifted = ids + offset
+                used = np.union1d(used, shifted)
+                next_free = max(next_free or 0, int(shifted.max()) + 1)
+            offsets.append(offset)
+        return offsets
+
+    @staticmethod
+    def find_duplicate_ids(filenames: List[str], ids_per_file: List[np.ndarray]) -> Dict[int, List[str]]:
+        """
+        查找在多个文件中 (或同一文件中多次) 出现的实体ID
+
+        Args:
+            filenames: 文件路径列表
+            ids_per_file: 每个文件的实体ID数组
+
+        Returns:
+            Dict[int, List[str]]: 重复的实体ID -> 出现的文件 (按出现次数重复列出)
+        """
+        if not ids_per_file:
+            return {}
+        all_ids = np.concatenate(ids_per_file)
+        file_index = np.repeat(np.arange(len(ids_per_file)), [len(ids) for ids in ids_per_file])
+
+        _, inverse, counts = np.unique(all_ids, return_inverse=True, return_counts=True)
+        duplicated = counts[inverse] > 1
+
+        duplicates: Dict[int, List[str]] = {}
+        for entity_id, index in zip(all_ids[duplicated].tolist(), file_index[duplicated].tolist()):
+            duplicates.setdefault(entity_id, []).append(filenames[index])
+        return duplicates
+
+    @staticmethod
+    def merge(filenames: List[str], output: str, allow_duplicates: bool = False, rebase: bool = False) -> bool:
+        """
+        合并多个GIA文件
+
+        Args:
+            filenames: 输入文件路径列表，按顺序拼接
+            output: 输出文件路径，可以是输入文件之一
+            allow_duplicates: 为False时存在重复的实体ID则不合并
+            rebase: 为True时与前面文件的实体ID冲突的文件整体改写实体ID，其余文件仍直接复制
+
+        Returns:
+            bool: 合并是否成功
+        """
+        ranges = []
+        ids_per_file: List[np.ndarray] = []
+        for filename in filenames:
+            try:
+                proto_data, header = FileHelper.load_mapped(filename)
+            except OSError as e:
+                print(f"Error: 读取文件失败 {e}")
+                return False
+            if not header.valid:
+                print(f"Error: 文件格式不正确 {filename}")
+                return False
+
+            try:
+                ids_per_file.append(GIAMerger.scan_entity_ids(proto_data))
+            except ValueError as e:
+                print(f"Error: 解析文件失败 {filename}: {e}")
+                return False
+            finally:
+                proto_data.release()
+            ranges.append((filename, FileHelper.HEADER_SIZE, header.proto_size))
+
+        offsets = GIAMerger.compute_offsets(ids_per_file) if rebase else [0] * len(filenames)
+        if any(offsets):
+            for filename, offset in zip(filenames, offsets):
+                if offset:
+                    print(f"{filename}: 实体ID偏移 {offset}")
+            ids_per_file = [ids + offset for ids, offset in zip(ids_per_file, offsets)]
+
+        duplicates = GIAMerger.find_duplicate_ids(filenames, ids_per_file)
+        if duplicates:
+            print(f"{'Warning' if allow_duplicates else 'Error'}: {len(duplicates)} 个实体ID重复")
+            for entity_id, sources in list(duplicates.items())[:10]:
+                print(f"  {entity_id}: {', '.join(sources)}")
+            if len(duplicates) > 10:
+                print(f"  ... 还有 {len(duplicates) - 10} 个")
+            if not allow_duplicates:
+                return False
+
+        total = sum(len(ids) for ids in ids_per_file)
+        print(f"合并 {len(filenames)} 个文件，共 {total} 个实体")
+        if not any(offsets):
+            return FileHelper.save_file_ranges(ranges, output)
+        return GIAMerger._save_rebased(ranges, offsets, output)
+
+    @staticmethod
+    def _save_rebased(ranges: List[Tuple[str, int, int]], offsets: List[int], output: str) -> bool:
+        """
+        逐个文件写入，偏移量为0的文件直接分块读取，其余文件映射后逐条改写实体ID
+
+        每个文件只在写入期间映射，且只输出bytes、不保留映射的切片，
+        替换输出文件前所有映射都已关闭，输出文件可以是输入文件之一 (Windows无法替换仍被映射的文件)
+        """
+        def iter_chunks():
+            for (filename, start, count), offset in zip(ranges, offsets):
+                if offset:
+                    proto_data = FileHelper.load_mapped(filename)[0]
+                    try:
+                        for record in EntityIdRebaser(offset=offset).iter_records(proto_data):
+                            yield bytes(record)
+                    finally:
+                        proto_data.release()
+                else:
+                    with open(filename, 'rb') as f:
+                        f.seek(start)
+                        while count > 0:
+                            chunk = f.read(min(count, FileHelper.STREAM_BUFFER_SIZE))
+                            if not chunk:
+                                raise EOFError(f"文件在读取过程中被截断 {filename}")
+                            yield chunk
+                            count -= len(chunk)
+
+        return FileHelper.save_stream(iter_chunks(), output)
+
+
+def main():
+    options = {'--allow-duplicates', '--rebase'}
+    args = [arg for arg in sys.argv[1:] if arg not in options]
+    if len(args) < 2:
+        print("用法: python helper/gia_merger.py 输出文件 输入文件1 输入文件2 ... [--allow-duplicates] [--rebase]")
+        sys.exit(2)
+
+    success = GIAMerger.merge(args[1:], args[0], allow_duplicates='--allow-duplicates' in sys.argv,
+                              rebase='--rebase' in sys.argv)
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+调色板空间索引
+color_distance_hsv等价于点 (s·cos h, s·sin h, v) 之间的欧氏距离，
+因此可以在该空间中建立KD树，精确查询最近的模板
+"""
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from config.block_config import BlockTemplate, BlockConfig
+from helper.block_helper import BlockHelper
+from helper.template_registry import TemplateRegistry
+
+
+class PaletteIndex:
+    """
+    模板颜色的KD树索引
+
+    叶子节点保存最多LEAF_SIZE个模板，查询时对所有颜色并行下探到所在叶子，
+    再按叶子包围盒与当前第k近距离做剪枝，结果是精确的k近邻
+    """
+
+    LEAF_SIZE = 8
+
+    # 每批查询的颜色数量
+    QUERY_CHUNK_SIZE = 65536
+
+    def __init__(self, templates: Union[List[BlockTemplate], TemplateRegistry, None] = None,
+                 leaf_size: int = LEAF_SIZE):
+        if templates is None:
+            templates = BlockConfig.AVAILABLE_BLOCKS
+        registry = templates if isinstance(templates, TemplateRegistry) else TemplateRegistry.of(templates)
+
+        self.templates = list(registry.templates)
+        self.leaf_size = max(1, leaf_size)
+        self.points = registry.points
+
+        # 树结构：内部节点保存分割维度和分割值，叶子节点保存叶子编号
+        self._split_dim: List[int] = []
+        self._split_value: List[float] = []
+        self._left: List[int] = []
+        self._right: List[int] = []
+        self._leaf_of_node: List[int] = []
+        self._leaf_members: List[np.ndarray] = []
+
+        self._build(np.arange(len(self.templates)))
+
+        self._split_dim = np.array(self._split_dim, dtype=np.intp)
+        self._split_value = np.array(self._split_value, dtype=np.float64)
+        self._left = np.array(self._left, dtype=np.intp)
+        self._right = np.array(self._right, dtype=np.intp)
+        self._leaf_of_node = np.array(self._leaf_of_node, dtype=np.intp)
+        self._leaf_min = np.array([self.points[m].min(axis=0) for m in self._leaf_members])
+        self._leaf_max = np.array([self.points[m].max(axis=0) for m in self._leaf_members])
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    @staticmethod
+    def rgb_to_points(rgb_array: np.ndarray) -> np.ndarray:
+        """
+        将RGB颜色映射到 (s·cos h, s·sin h, v) 空间
+
+        Args:
+            rgb_array: (..., 3) RGB数组，范围0-255
+
+        Returns:
+            (..., 3) float64 坐标数组
+        """
+        return BlockHelper.rgb_array_to_polar(rgb_array)
+
+    def _build(self, members: np.ndarray) -> int:
+        node = len(self._split_dim)
+        self._split_dim.append(-1)
+        self._split_value.append(0.0)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._leaf_of_node.append(-1)
+
+        points = self.points[members]
+        extent = points.max(axis=0) - points.min(axis=0)
+        if len(members) <= self.leaf_size or not extent.any():
+            self._leaf_of_node[node] = len(self._leaf_members)
+            self._leaf_members.append(members)
+            return node
+
+        # 沿跨度最大的维度按中位数分割
+        dim = int(np.argmax(extent))
+        order = np.argsort(points[:, dim], kind='stable')
+        half = len(members) // 2
+        split_value = float(points[order[half - 1], dim])
+
+        left_mask = points[:, dim] <= split_value
+        # 中位数附近有重复值时保证两侧都不为空
+        if left_mask.all():
+            left_mask = points[:, dim] < split_value
+
+        self._split_dim[node] = dim
+        self._split_value[node] = split_value
+        self._left[node] = self._build(members[left_mask])
+        self._right[node] = self._build(members[~left_mask])
+        return node
+
+    def _descend(self, points: np.ndarray) -> np.ndarray:
+        """返回每个查询点所在的叶子编号"""
+        nodes = np.zeros(len(points), dtype=np.intp)
+        while True:
+            inner = self._leaf_of_node[nodes] < 0
+            if not inner.any():
+                return self._leaf_of_node[nodes]
+            inner_nodes = nodes[inner]
+            go_left = points[inner, self._split_dim[inner_nodes]] <= self._split_value[inner_nodes]
+            nodes[inner] = np.where(go_left, self._left[inner_nodes], self._right[inner_nodes])
+
+    @staticmethod
+    def _merge(best_dist: np.ndarray, best_idx: np.ndarray,
+               new_dist: np.ndarray, new_idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """合并候选，按 (距离, 模板下标) 排序保留前k个"""
+        dist = np.concatenate((best_dist, new_dist), axis=1)
+        idx = np.concatenate((best_idx, new_idx), axis=1)
+        order = np.lexsort((idx, dist), axis=-1)[:, :k]
+        return np.take_along_axis(dist, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+    def _leaf_distances(self, points: np.ndarray, leaf: int) -> Tuple[np.ndarray, np.ndarray]:
+        members = self._leaf_members[leaf]
+        diff = points[:, None, :] - self.points[members][None, :, :]
+        dist = np.sqrt(np.einsum('nmk,nmk->nm', diff, diff))
+        return dist, np.broadcast_to(members, dist.shape)
+
+    def _query_points(self, points: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(points)
+        best_dist = np.full((n, k), np.inf)
+        best_idx = np.full((n, k), len(self.templates), dtype=np.intp)
+
+        # 先在所在叶子内搜索，得到较紧的初始上界
+        home_leaf = self._descend(points)
+        for leaf in np.unique(home_leaf):
+            rows = np.flatnonzero(home_leaf == leaf)
+            dist, idx = self._leaf_distances(points[rows], leaf)
+            best_dist[rows], best_idx[rows] = self._merge(best_dist[rows], best_idx[rows], dist, idx, k)
+
+        # 再检查包围盒距离不超过当前第k近距离的其他叶子
+        for leaf in range(len(self._leaf_members)):
+            gap = np.maximum(self._leaf_min[leaf] - points, 0.0) + np.maximum(points - self._leaf_max[leaf], 0.0)
+            lower_bound = np.sqrt(np.einsum('nk,nk->n', gap, gap))
+            rows = np.flatnonzero((lower_bound <= best_dist[:, -1]) & (home_leaf != leaf))
+            if len(rows) == 0:
+                continue
+            dist, idx = self._leaf_distances(points[rows], leaf)
+            best_dist[rows], best_idx[rows] = self._merge(best_dist[rows], best_idx[rows], dist, idx, k)
+
+        return best_dist, best_idx
+
+    def query(self, rgb_array: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量查询k个最接近的模板
+
+        Args:
+            rgb_array: (..., 3) RGB数组，范围0-255
+            k: 返回的近邻数量，超过模板数量时按模板数量截断
+
+        Returns:
+            (distances, indices): 形状均为 (..., k)，按距离升序排列，
+                                  距离相同时模板下标小的在前
+        """
+        rgb_array = np.asarray(rgb_array)
+        if rgb_array.shape[-1] != 3:
+            raise ValueError(f"颜色数组的最后一维应为3，当前形状为 {rgb_array.shape}")
+
+        k = max(1, min(k, len(self.templates)))
+        points = self.rgb_to_points(rgb_array.reshape(-1, 3))
+
+        distances = np.empty((len(points), k), dtype=np.float64)
+        indices = np.empty((len(points), k), dtype=np.intp)
+        for start in range(0, len(points), self.QUERY_CHUNK_SIZE):
+            end = start + self.QUERY_CHUNK_SIZE
+            distances[start:end], indices[start:end] = self._query_points(points[start:end], k)
+
+        shape = rgb_array.shape[:-1] + (k,)
+        return distances.reshape(shape), indices.reshape(shape)
+
+    def nearest(self, rgb_array: np.ndarray) -> np.ndarray:
+        """
+        批量查询最接近的模板
+
+        Args:
+            rgb_array: (..., 3) RGB数组，范围0-255
+
+        Returns:
+            (...) 模板在templates中的下标
+        """
+        _, indices = self.query(rgb_array, k=1)
+        return indices[..., 0]
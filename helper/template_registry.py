@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+方块模板注册表
+为模板列表建立按ID、按颜色的索引，并预先计算每个模板的缩放、HSV和极坐标
+"""
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.block_config import BlockTemplate, BlockConfig
+
+
+@dataclass(frozen=True)
+class TemplateInfo:
+    """
+    模板及其预计算数据
+    """
+    index: int  # 在模板列表中的下标
+    template: BlockTemplate
+    template_id: int
+    color_tuple: Tuple[int, int, int]
+    scale: Tuple[float, float, float]  # calculate_scale(template)，即全局缩放为1时的缩放
+    hsv: Tuple[float, float, float]  # rgb_to_hsv(color_tuple)
+    polar: Tuple[float, float, float]  # (s·cos h, s·sin h, v)
+
+
+class TemplateRegistry:
+    """
+    不可变的模板注册表
+
+    创建时对模板列表做快照，之后修改BlockTemplate不会影响已创建的注册表。
+    of()和default()按模板列表对象本身缓存，查找为O(1)；原地修改了模板后需调用invalidate()
+    """
+
+    # 按模板列表内容缓存的注册表，内容相同的列表共用
+    _cache: Dict[tuple, 'TemplateRegistry'] = {}
+
+    # 按模板元组对象缓存: id -> (元组, 注册表)，保存元组本身，id不会被复用
+    _by_identity: Dict[int, Tuple[tuple, 'TemplateRegistry']] = {}
+    MAX_IDENTITY_CACHE = 64
+
+    # BlockConfig.AVAILABLE_BLOCKS的注册表，以及创建时的AVAILABLE_BLOCKS对象
+    _default: Optional['TemplateRegistry'] = None
+    _default_source: Optional[tuple] = None
+
+    def __init__(self, templates: List[BlockTemplate]):
+        if not templates:
+            raise ValueError("方块模板列表为空")
+
+        # BlockHelper在查找时使用注册表，在此处导入以避免循环导入
+        from helper.block_helper import BlockHelper
+
+        self.templates: Tuple[BlockTemplate, ...] = tuple(templates)
+
+        infos = []
+        for index, template in enumerate(self.templates):
+            hsv = BlockHelper.rgb_to_hsv(template.color_tuple)
+            polar = BlockHelper.rgb_array_to_polar(np.array(template.color_tuple, dtype=np.float64))
+            infos.append(TemplateInfo(
+                index=index,
+                template=template,
+                template_id=template.template_id,
+                color_tuple=tuple(template.color_tuple),
+                scale=BlockHelper.calculate_scale(template),
+                hsv=hsv,
+                polar=(float(polar[0]), float(polar[1]), float(polar[2])),
+            ))
+        self.infos: Tuple[TemplateInfo, ...] = tuple(infos)
+
+        # 与线性查找一致，ID或颜色重复时保留第一个
+        by_id = {}
+        by_color = {}
+        for info in self.infos:
+            by_id.setdefault(info.template_id, info)
+            by_color.setdefault(info.color_tuple, info)
+        self.by_id = MappingProxyType(by_id)
+        self.by_color = MappingProxyType(by_color)
+
+        self.template_ids = self._frozen_array([info.template_id for info in self.infos], np.int64)
+        self.colors = self._frozen_array([info.color_tuple for info in self.infos], np.uint8)
+        self.scales = self._frozen_array([info.scale for info in self.infos], np.float64)
+        self.hsv = self._frozen_array([info.hsv for info in self.infos], np.float64)
+        self.points = self._frozen_array([info.polar for info in self.infos], np.float64)
+
+        self._palette_index = None
+
+    @staticmethod
+    def _frozen_array(values, dtype) -> np.ndarray:
+        array = np.array(values, dtype=dtype)
+        array.flags.writeable = False
+        return array
+
+    @staticmethod
+    def _signature(templates: List[BlockTemplate]) -> tuple:
+        return tuple((template.template_id,
+                      tuple(template.color_tuple),
+                      template.size_units,
+                      tuple(template.default_scale_tuple)) for template in templates)
+
+    @staticmethod
+    def _lookup(templates: List[BlockTemplate]) -> 'TemplateRegistry':
+        """按内容查找或创建注册表"""
+        key = TemplateRegistry._signature(templates)
+        registry = TemplateRegistry._cache.get(key)
+        if registry is None:
+            registry = TemplateRegistry(templates)
+            TemplateRegistry._cache[key] = registry
+        return registry
+
+    @staticmethod
+    def of(templates: List[BlockTemplate]) -> 'TemplateRegistry':
+        """
+        获取模板列表对应的注册表，内容相同的模板列表共用同一个注册表
+
+        元组不可变，按对象缓存，同一个元组再次查找为O(1)；
+        列表可能被原地修改，每次按内容查找
+
+        Args:
+            templates: 模板列表或元组
+
+        Returns:
+            TemplateRegistry: 注册表
+        """
+        if templates is BlockConfig.AVAILABLE_BLOCKS:
+            return TemplateRegistry.default()
+        if not isinstance(templates, tuple):
+            return TemplateRegistry._lookup(templates)
+
+        cached = TemplateRegistry._by_identity.get(id(templates))
+        if cached is not None and cached[0] is templates:
+            return cached[1]
+        registry = TemplateRegistry._lookup(templates)
+        if len(TemplateRegistry._by_identity) >= TemplateRegistry.MAX_IDENTITY_CACHE:
+            TemplateRegistry._by_identity.clear()
+        TemplateRegistry._by_identity[id(templates)] = (templates, registry)
+        return registry
+
+    @staticmethod
+    def default() -> 'TemplateRegistry':
+        """
+        获取BlockConfig.AVAILABLE_BLOCKS (不可变的元组) 的注册表，AVAILABLE_BLOCKS被替换后自动重建
+
+        Returns:
+            TemplateRegistry: 注册表
+        """
+        if TemplateRegistry._default_source is not BlockConfig.AVAILABLE_BLOCKS:
+            TemplateRegistry._default = TemplateRegistry._lookup(BlockConfig.AVAILABLE_BLOCKS)
+            TemplateRegistry._default_source = BlockConfig.AVAILABLE_BLOCKS
+        return TemplateRegistry._default
+
+    @staticmethod
+    def invalidate():
+        """清空所有缓存的注册表，原地修改BlockTemplate的属性后调用"""
+        TemplateRegistry._cache.clear()
+        TemplateRegistry._by_identity.clear()
+        TemplateRegistry._default = None
+        TemplateRegistry._default_source = None
+
+    def __len__(self) -> int:
+        return len(self.infos)
+
+    def __iter__(self):
+        return iter(self.infos)
+
+    def __getitem__(self, index: int) -> TemplateInfo:
+        return self.infos[index]
+
+    def get(self, template_id: int) -> Optional[TemplateInfo]:
+        """
+        根据template_id查找模板
+
+        Args:
+            template_id: 目标template_id
+
+        Returns:
+            TemplateInfo，未查找到则为None
+        """
+        return self.by_id.get(template_id)
+
+    def get_scale(self, index: int, global_scale: float = 1.0) -> Tuple[float, float, float]:
+        """
+        获取模板的缩放，结果与calculate_scale(template, global_scale)一致
+
+        Args:
+            index: 模板下标
+            global_scale: 全局缩放参数
+
+        Returns:
+            (scale_x, scale_y, scale_z) 最终缩放值
+        """
+        scale_x, scale_y, scale_z = self.infos[index].scale
+        return scale_x * global_scale, scale_y * global_scale, scale_z * global_scale
+
+    @property
+    def palette_index(self):
+        """该模板列表的调色板索引，首次访问时构建"""
+        if self._palette_index is None:
+            from helper.palette_index import PaletteIndex
+            self._palette_index = PaletteIndex(self)
+        return self._palette_index
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+protobuf线格式读取工具类
+不解码消息，只按字段扫描字节，用于定位记录的字节范围和读取少量字段
+"""
+
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class WireHelper:
+    """
+    线格式读取工具
+    """
+
+    VARINT = 0
+    FIXED64 = 1
+    LENGTH_DELIMITED = 2
+    FIXED32 = 5
+
+    @staticmethod
+    def decode_varint(buffer: Buffer, pos: int) -> Tuple[int, int]:
+        """
+        读取varint
+
+        Args:
+            buffer: 字节数据
+            pos: 起始位置
+
+        Returns:
+            (value, pos): 值和varint之后的位置
+        """
+        try:
+            byte = buffer[pos]
+            # 单字节varint (标签、短长度) 最常见
+            if byte < 0x80:
+                return byte, pos + 1
+
+            result = byte & 0x7F
+            shift = 7
+            pos += 1
+            while True:
+                byte = buffer[pos]
+                pos += 1
+                result |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    return result, pos
+                shift += 7
+                if shift >= 64:
+                    raise ValueError("varint过长")
+        except IndexError:
+            raise ValueError("varint不完整") from None
+
+    @staticmethod
+    def to_int32(value: int) -> int:
+        """把按64位补码编码的varint还原为int32"""
+        value &= 0xFFFFFFFF
+        return value - (1 << 32) if value >= (1 << 31) else value
+
+    @staticmethod
+    def iter_fields(buffer: Buffer, start: int = 0,
+                    end: Optional[int] = None) -> Iterator[Tuple[int, int, int, int, int]]:
+        """
+        按顺序扫描消息中的字段
+
+        Args:
+            buffer: 字节数据
+            start: 消息起始位置
+            end: 消息结束位置，为None时到数据末尾
+
+        Returns:
+            Iterator[(field_number, wire_type, field_start, value_start, value_end)]:
+                字段号、线类型、字段 (含tag) 的起始位置、值的起始和结束位置。
+                长度前缀字段的值不含长度前缀，varint字段的值为varint本身的字节
+        """
+        if end is None:
+            end = len(buffer)
+        pos = start
+        while pos < end:
+            field_start = pos
+            tag, pos = WireHelper.decode_varint(buffer, pos)
+            field_number = tag >> 3
+            wire_type = tag & 0x07
+
+            if wire_type == WireHelper.VARINT:
+                value_start = pos
+                _, pos = WireHelper.decode_varint(buffer, pos)
+            elif wire_type == WireHelper.LENGTH_DELIMITED:
+                length, value_start = WireHelper.decode_varint(buffer, pos)
+                pos = value_start + length
+            elif wire_type == WireHelper.FIXED32:
+                value_start = pos
+                pos += 4
+            elif wire_type == WireHelper.FIXED64:
+                value_start = pos
+                pos += 8
+            else:
+                raise ValueError(f"不支持的线类型 {wire_type} (位置 {field_start})")
+
+            if pos > end:
+                raise ValueError(f"字段 {field_number} 超出消息范围 (位置 {field_start})")
+            yield field_number, wire_type, field_start, value_start, pos
+
+    @staticmethod
+    def iter_record_spans(buffer: Buffer, field_number: int = 1) -> Iterator[Tuple[int, int, int]]:
+        """
+        扫描顶层的repeated消息字段，如GIACollection.Assets
+
+        Args:
+            buffer: 字节数据
+            field_number: 字段号
+
+        Returns:
+            Iterator[(record_start, value_start, value_end)]: 记录 (含tag和长度) 的起始位置，消息的起始和结束位置
+        """
+        for number, wire_type, field_start, value_start, value_end in WireHelper.iter_fields(buffer):
+            if number == field_number and wire_type == WireHelper.LENGTH_DELIMITED:
+                yield field_start, value_start, value_end
+
+    @staticmethod
+    def find_field(buffer: Buffer, start: int, end: int,
+                   field_number: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        查找消息中第一个指定字段号的字段
+
+        Args:
+            buffer: 字节数据
+            start: 消息起始位置
+            end: 消息结束位置
+            field_number: 字段号
+
+        Returns:
+            Optional[(wire_type, field_start, value_start, value_end)]: 未找到时为None
+        """
+        for number, wire_type, field_start, value_start, value_end in WireHelper.iter_fields(buffer, start, end):
+            if number == field_number:
+                return wire_type, field_start, value_start, value_end
+        return None
+
+    @staticmethod
+    def read_varint_path(buffer: Buffer, start: int, end: int, path: Sequence[int]) -> Optional[int]:
+        """
+        沿字段号路径读取嵌套消息中的varint字段，如Asset的 (1, 4) 为meta.asset_id
+
+        Args:
+            buffer: 字节数据
+            start: 消息起始位置
+            end: 消息结束位置
+            path: 字段号路径，除最后一个外都是消息字段
+
+        Returns:
+            Optional[int]: 字段值 (无符号)，字段不存在 (proto3中即为0) 时为None
+        """
+        for depth, field_number in enumerate(path):
+            found = WireHelper.find_field(buffer, start, end, field_number)
+            if found is None:
+                return None
+            wire_type, _, start, end = found
+            if depth < len(path) - 1:
+                if wire_type != WireHelper.LENGTH_DELIMITED:
+                    raise ValueError(f"字段 {field_number} 不是消息 (位置 {start})")
+            elif wire_type != WireHelper.VARINT:
+                raise ValueError(f"字段 {field_number} 不是varint (位置 {start})")
+        return WireHelper.decode_varint(buffer, start)[0]
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+方块批量数据类
+以列式 (structure-of-arrays) 存储大量方块，避免为每个方块创建BlockModel和名称字符串
+"""
+
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from model.block_model import BlockModel
+
+
+@dataclass(eq=False)
+class BlockBatch:
+    """
+    方块批量数据类
+
+    entity_id为AUTO_ENTITY_ID的方块由BlockAssembler自动分配实体ID，
+    名称在需要时才按name_format和name_args生成，如 name_format="Pixel_{0}_{1}"
+    """
+    AUTO_ENTITY_ID = -1
+
+    # 按块转换为Python对象，兼顾速度与内存
+    ITER_CHUNK_SIZE = 4096
+
+    template_id: np.ndarray  # (N,) int64
+    position: np.ndarray  # (N, 3) float64
+    scale: np.ndarray  # (N, 3) float64
+    rotation: Optional[np.ndarray] = None  # (N, 3) float64，为None时全部为0
+    entity_id: Optional[np.ndarray] = None  # (N,) int64，为None时全部自动分配
+
+    name_format: str = ""
+    name_args: Optional[np.ndarray] = None  # (N, K) int64，按下标填入name_format
+    names: Optional[Sequence[str]] = None  # 直接指定的名称，优先于name_format
+
+    def __post_init__(self):
+        self.template_id = np.asarray(self.template_id, dtype=np.int64).reshape(-1)
+        count = len(self.template_id)
+
+        self.position = np.asarray(self.position, dtype=np.float64).reshape(count, 3)
+        self.scale = np.asarray(self.scale, dtype=np.float64).reshape(count, 3)
+
+        # 未指定的列使用零步长的广播视图，不占用额外内存
+        if self.rotation is None:
+            self.rotation = np.broadcast_to(np.zeros(3, dtype=np.float64), (count, 3))
+        else:
+            self.rotation = np.asarray(self.rotation, dtype=np.float64).reshape(count, 3)
+
+        if self.entity_id is None:
+            self.entity_id = np.broadcast_to(np.int64(self.AUTO_ENTITY_ID), (count,))
+        else:
+            self.entity_id = np.asarray(self.entity_id, dtype=np.int64).reshape(count)
+
+        if self.name_args is not None:
+            self.name_args = np.asarray(self.name_args, dtype=np.int64)
+            if self.name_args.ndim == 1:
+                self.name_args = self.name_args.reshape(count, 1)
+            if len(self.name_args) != count:
+                raise ValueError(f"名称参数数量 {len(self.name_args)} 与方块数量 {count} 不一致")
+
+        if self.names is not None and len(self.names) != count:
+            raise ValueError(f"名称数量 {len(self.names)} 与方块数量 {count} 不一致")
+
+    def __len__(self) -> int:
+        return len(self.template_id)
+
+    def get_name(self, index: int) -> str:
+        """
+        获取第index个方块的名称
+
+        Args:
+            index: 方块下标
+
+        Returns:
+            str: 方块名称，未设置名称时为空字符串
+        """
+        if self.names is not None:
+            return self.names[index]
+        if not self.name_format:
+            return ""
+        if self.name_args is None:
+            return self.name_format
+        return self.name_format.format(*self.name_args[index].tolist())
+
+    def iter_names(self) -> Iterator[str]:
+        """按顺序生成所有方块的名称"""
+        if self.names is not None:
+            yield from self.names
+        elif not self.name_format or self.name_args is None:
+            for _ in range(len(self)):
+                yield self.name_format
+        else:
+            name_format = self.name_format
+            for start in range(0, len(self), self.ITER_CHUNK_SIZE):
+                for args in self.name_args[start:start + self.ITER_CHUNK_SIZE].tolist():
+                    yield name_format.format(*args)
+
+    def __iter__(self) -> Iterator[BlockModel]:
+        """按顺序逐个生成BlockModel，同一时间只有一小块数据被转换为Python对象"""
+        names = self.iter_names()
+        for start in range(0, len(self), self.ITER_CHUNK_SIZE):
+            end = start + self.ITER_CHUNK_SIZE
+            rows = zip(self.template_id[start:end].tolist(),
+                       self.entity_id[start:end].tolist(),
+                       self.position[start:end].tolist(),
+                       self.rotation[start:end].tolist(),
+                       self.scale[start:end].tolist())
+            for template_id, entity_id, position, rotation, scale in rows:
+                yield BlockModel(
+                    template_id=template_id,
+                    entity_id=None if entity_id == self.AUTO_ENTITY_ID else entity_id,
+                    name=next(names),
+                    position_x=position[0],
+                    position_y=position[1],
+                    position_z=position[2],
+                    rotation_x=rotation[0],
+                    rotation_y=rotation[1],
+                    rotation_z=rotation[2],
+                    scale_x=scale[0],
+                    scale_y=scale[1],
+                    scale_z=scale[2]
+                )
+
+    def to_blocks(self) -> List[BlockModel]:
+        """转换为BlockModel列表"""
+        return list(self)
+
+    @staticmethod
+    def _take_column(column: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """选取一列，所有行相同的零步长列仍保持为广播视图"""
+        if len(column) > 0 and column.strides[0] == 0:
+            return np.broadcast_to(column[0], (len(indices),) + column.shape[1:])
+        return column[indices]
+
+    def take(self, indices: np.ndarray) -> 'BlockBatch':
+        """
+        按下标或布尔掩码选取部分方块
+
+        Args:
+            indices: 下标数组或长度为N的布尔数组
+
+        Returns:
+            BlockBatch: 新的方块批量数据
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == np.bool_:
+            indices = np.flatnonzero(indices)
+        else:
+            indices = indices.astype(np.intp).reshape(-1)
+
+        return BlockBatch(
+            template_id=self.template_id[indices],
+            position=self.position[indices],
+            scale=self.scale[indices],
+            rotation=self._take_column(self.rotation, indices),
+            entity_id=self._take_column(self.entity_id, indices),
+            name_format=self.name_format,
+            name_args=None if self.name_args is None else self.name_args[indices],
+            names=None if self.names is None else [self.names[i] for i in indices.tolist()]
+        )
+
+    @staticmethod
+    def from_blocks(blocks: List[BlockModel]) -> 'BlockBatch':
+        """
+        从BlockModel列表创建
+
+        Args:
+            blocks: 方块数据列表
+
+        Returns:
+            BlockBatch: 方块批量数据
+        """
+        return BlockBatch(
+            template_id=[block.template_id for block in blocks],
+            position=[(block.position_x, block.position_y, block.position_z) for block in blocks],
+            scale=[(block.scale_x, block.scale_y, block.scale_z) for block in blocks],
+            rotation=[(block.rotation_x, block.rotation_y, block.rotation_z) for block in blocks],
+            entity_id=[BlockBatch.AUTO_ENTITY_ID if block.entity_id is None else block.entity_id
+                       for block in blocks],
+            names=[block.name for block in blocks]
+        )
+
+    @staticmethod
+    def concat(batches: List['BlockBatch']) -> 'BlockBatch':
+        """
+        按顺序拼接多个方块批量数据，名称格式不同时展开为names
+
+        Args:
+            batches: 方块批量数据列表
+
+        Returns:
+            BlockBatch: 拼接后的方块批量数据
+        """
+        if not batches:
+            return BlockBatch(template_id=np.zeros(0, dtype=np.int64),
+                              position=np.zeros((0, 3)),
+                              scale=np.zeros((0, 3)))
+
+        same_format = (all(batch.names is None and batch.name_args is not None for batch in batches)
+                       and len({batch.name_format for batch in batches}) == 1
+                       and len({batch.name_args.shape[1] for batch in batches}) == 1)
+
+        return BlockBatch(
+            template_id=np.concatenate([batch.template_id for batch in batches]),
+            position=np.concatenate([batch.position for batch in batches]),
+            scale=np.concatenate([batch.scale for batch in batches]),
+            rotation=np.concatenate([batch.rotation for batch in batches]),
+            entity_id=np.concatenate([batch.entity_id for batch in batches]),
+            name_format=batches[0].name_format if same_format else "",
+            name_args=np.concatenate([batch.name_args for batch in batches]) if same_format else None,
+            names=None if same_format else [name for batch in batches for name in batch.iter_names()]
+        )
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GIA文件头信息
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class GIAHeader:
+    """
+    GIA文件的header和footer，valid表示两个大小字段、三个固定值和footer是否都符合格式
+    """
+    file_size: int
+    size_field_1: int = 0  # 期望为 file_size - 4
+    size_field_2: int = 0  # 期望为 file_size - 24
+    field_1: bytes = b''
+    field_2: bytes = b''
+    field_3: bytes = b''
+    footer: bytes = b''
+    valid: bool = False
+
+    @property
+    def proto_size(self) -> int:
+        """protobuf数据大小"""
+        return max(self.file_size - 24, 0)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量生成报告
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+
+@dataclass
+class IncrementalReport:
+    """
+    与上一次输出相比的实体变化，每项为 (名称, 实体ID)
+    """
+    added: List[Tuple[str, int]] = field(default_factory=list)
+    removed: List[Tuple[str, int]] = field(default_factory=list)
+    changed: List[Tuple[str, int]] = field(default_factory=list)
+    unchanged_count: int = 0
+
+    def summary(self) -> str:
+        return (f"新增 {len(self.added)} 个，删除 {len(self.removed)} 个，"
+                f"修改 {len(self.changed)} 个，未改变 {self.unchanged_count} 个")
+
+    def save(self, filename: str):
+        """
+        保存为文本文件，每行一个实体
+
+        Args:
+            filename: 保存的文件路径
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.summary() + "\n")
+            for title, entries in (("新增", self.added), ("删除", self.removed), ("修改", self.changed)):
+                f.write(f"\n[{title}] {len(entries)}\n")
+                for name, entity_id in entries:
+                    f.write(f"{entity_id}\t{name}\n")